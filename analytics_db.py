@@ -0,0 +1,275 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import logging
+from collections import Counter
+from datetime import datetime
+from log_writer import BatchedLogWriter
+
+logger = logging.getLogger(__name__)
+
+
+class AnalyticsDB(BatchedLogWriter):
+    """SQLite store for search, download and error logs with indexed queries
+
+    Records are queued like with BatchedLogWriter and inserted in batches,
+    one transaction per batch, by the writer thread. Every batch also
+    updates hourly rollups (totals, per user and per error type) and each
+    user's last activity, so queries over a time range read one row per
+    hour plus the raw rows of the first, partial hour, however many rows
+    the logs hold.
+    """
+
+    # Columns of each log table besides id and ts
+    TABLES = {
+        "searches": ("user_id", "query", "results_count"),
+        "downloads": ("user_id", "video_id", "title", "artist"),
+        "errors": ("user_id", "error_type", "error_message", "context"),
+    }
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS searches (
+            id INTEGER PRIMARY KEY, ts REAL NOT NULL, user_id INTEGER,
+            query TEXT, results_count INTEGER
+        );
+        CREATE INDEX IF NOT EXISTS searches_ts ON searches (ts);
+        CREATE INDEX IF NOT EXISTS searches_user ON searches (user_id, ts);
+
+        CREATE TABLE IF NOT EXISTS downloads (
+            id INTEGER PRIMARY KEY, ts REAL NOT NULL, user_id INTEGER,
+            video_id TEXT, title TEXT, artist TEXT
+        );
+        CREATE INDEX IF NOT EXISTS downloads_ts ON downloads (ts);
+        CREATE INDEX IF NOT EXISTS downloads_user ON downloads (user_id, ts);
+
+        CREATE TABLE IF NOT EXISTS errors (
+            id INTEGER PRIMARY KEY, ts REAL NOT NULL, user_id INTEGER,
+            error_type TEXT, error_message TEXT, context TEXT
+        );
+        CREATE INDEX IF NOT EXISTS errors_ts ON errors (ts);
+        CREATE INDEX IF NOT EXISTS errors_user ON errors (user_id, ts);
+        CREATE INDEX IF NOT EXISTS errors_type ON errors (error_type, ts);
+
+        CREATE TABLE IF NOT EXISTS hourly_totals (
+            hour INTEGER PRIMARY KEY,
+            searches INTEGER NOT NULL DEFAULT 0,
+            downloads INTEGER NOT NULL DEFAULT 0,
+            errors INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE TABLE IF NOT EXISTS hourly_users (
+            user_id INTEGER NOT NULL,
+            hour INTEGER NOT NULL,
+            searches INTEGER NOT NULL DEFAULT 0,
+            downloads INTEGER NOT NULL DEFAULT 0,
+            errors INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, hour)
+        );
+        CREATE INDEX IF NOT EXISTS hourly_users_hour ON hourly_users (hour);
+        CREATE TABLE IF NOT EXISTS hourly_errors (
+            error_type TEXT NOT NULL,
+            hour INTEGER NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (error_type, hour)
+        );
+        CREATE INDEX IF NOT EXISTS hourly_errors_hour ON hourly_errors (hour);
+
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            first_seen REAL NOT NULL,
+            last_seen REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS users_last_seen ON users (last_seen);
+
+        CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+    """
+
+    def __init__(self, db_file, batch_size=100, flush_interval=1.0, import_logs=None):
+        """import_logs maps table names to JSON Lines logs imported once into a new database"""
+        self.db_file = db_file
+        self._local = threading.local()
+
+        os.makedirs(os.path.dirname(db_file) or ".", exist_ok=True)
+        db = self._connect()
+        db.executescript(self.SCHEMA)
+        if import_logs:
+            self._import_logs(db, import_logs)
+
+        super().__init__(batch_size=batch_size, flush_interval=flush_interval)
+
+    def _connect(self):
+        """Get this thread's connection"""
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.db_file, timeout=30)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    def _import_logs(self, db, import_logs):
+        """Load existing JSON Lines logs, once per database"""
+        with db:
+            db.execute("BEGIN IMMEDIATE")
+            if db.execute("SELECT 1 FROM meta WHERE key = 'logs_imported'").fetchone():
+                return
+            for table, file_path in import_logs.items():
+                if not os.path.exists(file_path):
+                    continue
+                imported = 0
+                batch = []
+                with open(file_path, 'r') as f:
+                    for line in f:
+                        try:
+                            batch.append(json.loads(line))
+                        except json.JSONDecodeError:
+                            continue
+                        if len(batch) >= 10000:
+                            imported += self._insert(db, table, batch)
+                            batch = []
+                imported += self._insert(db, table, batch)
+                logger.info(f"Imported {imported} records from {file_path} into {table}")
+            db.execute("INSERT INTO meta (key, value) VALUES ('logs_imported', ?)", (datetime.now().isoformat(),))
+
+    @staticmethod
+    def _timestamp(record):
+        try:
+            return datetime.fromisoformat(record["timestamp"]).timestamp()
+        except (KeyError, TypeError, ValueError):
+            return time.time()
+
+    def _insert(self, db, table, records):
+        """Insert records into a log table and its rollups; returns the number inserted"""
+        columns = self.TABLES[table]
+        rows = []
+        totals = Counter()
+        users = Counter()
+        seen = {}
+        error_types = Counter()
+        for record in records:
+            ts = self._timestamp(record)
+            values = [record.get(column) for column in columns]
+            if table == "errors" and values[3] is not None:
+                values[3] = json.dumps(values[3])
+            rows.append((ts, *values))
+
+            hour = int(ts // 3600)
+            totals[hour] += 1
+            if record.get("user_id") is not None:
+                users[(record["user_id"], hour)] += 1
+                first, last = seen.get(record["user_id"], (ts, ts))
+                seen[record["user_id"]] = (min(first, ts), max(last, ts))
+            if table == "errors":
+                error_types[(record.get("error_type") or "unknown", hour)] += 1
+
+        db.executemany(
+            f"INSERT INTO {table} (ts, {', '.join(columns)}) VALUES (?{', ?' * len(columns)})",
+            rows
+        )
+        db.executemany(
+            f"INSERT INTO hourly_totals (hour, {table}) VALUES (?, ?) "
+            f"ON CONFLICT (hour) DO UPDATE SET {table} = {table} + excluded.{table}",
+            totals.items()
+        )
+        db.executemany(
+            f"INSERT INTO hourly_users (user_id, hour, {table}) VALUES (?, ?, ?) "
+            f"ON CONFLICT (user_id, hour) DO UPDATE SET {table} = {table} + excluded.{table}",
+            [(user_id, hour, count) for (user_id, hour), count in users.items()]
+        )
+        db.executemany(
+            "INSERT INTO users (user_id, first_seen, last_seen) VALUES (?, ?, ?) "
+            "ON CONFLICT (user_id) DO UPDATE SET "
+            "first_seen = MIN(first_seen, excluded.first_seen), "
+            "last_seen = MAX(last_seen, excluded.last_seen)",
+            [(user_id, first, last) for user_id, (first, last) in seen.items()]
+        )
+        db.executemany(
+            "INSERT INTO hourly_errors (error_type, hour, count) VALUES (?, ?, ?) "
+            "ON CONFLICT (error_type, hour) DO UPDATE SET count = count + excluded.count",
+            [(error_type, hour, count) for (error_type, hour), count in error_types.items()]
+        )
+        return len(rows)
+
+    def _write_batch(self, pending):
+        if not pending:
+            return
+        count = sum(len(records) for records in pending.values())
+        try:
+            db = self._connect()
+            with db:
+                for table, records in pending.items():
+                    self._insert(db, table, records)
+            self.written += count
+            self.batches += 1
+        except Exception as e:
+            logger.error(f"Error writing {count} records to {self.db_file}: {str(e)}")
+
+    @staticmethod
+    def _split(since):
+        """Split a range starting at since into a raw partial hour and whole rollup hours"""
+        if since is None:
+            return 0.0, 0.0, 0
+        first_hour = -int(-since // 3600)
+        return since, first_hour * 3600.0, first_hour
+
+    def summary(self, since=None, user_id=None):
+        """Count searches, downloads and errors since a unix time, optionally for one user"""
+        start, edge, first_hour = self._split(since)
+        user_filter = "" if user_id is None else " AND user_id = :user_id"
+        rollup = "hourly_totals WHERE hour >= :hour" if user_id is None else \
+            "hourly_users WHERE user_id = :user_id AND hour >= :hour"
+        sql = (
+            "SELECT "
+            f"(SELECT COUNT(*) FROM searches WHERE ts >= :start AND ts < :edge{user_filter}), "
+            f"(SELECT COUNT(*) FROM downloads WHERE ts >= :start AND ts < :edge{user_filter}), "
+            f"(SELECT COUNT(*) FROM errors WHERE ts >= :start AND ts < :edge{user_filter}), "
+            f"(SELECT TOTAL(searches) FROM {rollup}), "
+            f"(SELECT TOTAL(downloads) FROM {rollup}), "
+            f"(SELECT TOTAL(errors) FROM {rollup})"
+        )
+        row = self._connect().execute(
+            sql, {"start": start, "edge": edge, "hour": first_hour, "user_id": user_id}
+        ).fetchone()
+        return {
+            "searches": int(row[0] + row[3]),
+            "downloads": int(row[1] + row[4]),
+            "errors": int(row[2] + row[5])
+        }
+
+    def active_users(self, since=None):
+        """Count distinct users seen since a unix time"""
+        return self._connect().execute(
+            "SELECT COUNT(*) FROM users WHERE last_seen >= ?",
+            (since or 0.0,)
+        ).fetchone()[0]
+
+    def errors_by_type(self, since=None):
+        """Get (error_type, count) pairs since a unix time, most frequent first"""
+        start, edge, first_hour = self._split(since)
+        sql = """
+            SELECT error_type, SUM(count) FROM (
+                SELECT error_type, count FROM hourly_errors WHERE hour >= :hour
+                UNION ALL SELECT COALESCE(error_type, 'unknown'), 1 FROM errors
+                    WHERE ts >= :start AND ts < :edge
+            ) GROUP BY error_type ORDER BY SUM(count) DESC
+        """
+        return self._connect().execute(
+            sql, {"start": start, "edge": edge, "hour": first_hour}
+        ).fetchall()
+
+    def hourly(self, since):
+        """Get (hour start, searches, downloads, errors) for every hour with activity since a unix time"""
+        return self._connect().execute(
+            "SELECT hour * 3600, searches, downloads, errors FROM hourly_totals "
+            "WHERE hour >= ? ORDER BY hour",
+            (int(since // 3600),)
+        ).fetchall()
+
+    def hourly_errors(self, since):
+        """Get (hour start, error_type, count) for every hour with errors since a unix time"""
+        return self._connect().execute(
+            "SELECT hour * 3600, error_type, count FROM hourly_errors "
+            "WHERE hour >= ? ORDER BY hour, error_type",
+            (int(since // 3600),)
+        ).fetchall()
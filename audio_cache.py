@@ -0,0 +1,173 @@
+import glob
+import os
+import shutil
+import threading
+import uuid
+import logging
+from collections import Counter, OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class AudioCache:
+    """Size-budgeted LRU cache of audio files in the downloads directory
+
+    Downloads are written to a private temporary directory and atomically
+    renamed into the cache once complete, so a published file is always
+    whole. Leftovers from crashed downloads are removed on startup. Files
+    that are in use are pinned and never evicted.
+    """
+
+    def __init__(self, cache_dir="downloads", max_bytes=2 * 1024 ** 3):
+        self.cache_dir = cache_dir
+        self.tmp_dir = os.path.join(cache_dir, ".tmp")
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._pins = Counter()
+        self._lock = threading.Lock()
+
+        os.makedirs(cache_dir, exist_ok=True)
+        self._cleanup()
+        self._scan()
+
+    @staticmethod
+    def _key(video_id, profile):
+        return f"{video_id}.{profile}"
+
+    def _cleanup(self):
+        """Remove partial files left behind by downloads that never finished"""
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+        os.makedirs(self.tmp_dir, exist_ok=True)
+
+        removed = 0
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            # Published files are named <video_id>.<profile>.<ext>
+            if os.path.isfile(path) and (name.count(".") != 2 or name.endswith((".part", ".ytdl"))):
+                os.remove(path)
+                removed += 1
+        if removed:
+            logger.info(f"Removed {removed} partial files from {self.cache_dir}")
+
+    def _scan(self):
+        """Index files published by earlier runs, least recently used first"""
+        files = []
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if os.path.isfile(path):
+                stat = os.stat(path)
+                files.append((stat.st_mtime, name, stat.st_size))
+
+        for _, name, size in sorted(files):
+            key = os.path.splitext(name)[0]
+            if key in self.entries:
+                # Only the newest file per key is kept
+                old_name, old_size = self.entries.pop(key)
+                self.total_bytes -= old_size
+                os.remove(os.path.join(self.cache_dir, old_name))
+            self.entries[key] = (name, size)
+            self.total_bytes += size
+        self._evict()
+        logger.info(f"Audio cache holds {len(self.entries)} files ({self.total_bytes / 1024 ** 2:.1f} MB)")
+
+    def _evict(self):
+        for key in list(self.entries):
+            if self.total_bytes <= self.max_bytes:
+                break
+            if self._pins[key]:
+                continue
+            name, size = self.entries.pop(key)
+            self.total_bytes -= size
+            self.evictions += 1
+            try:
+                os.remove(os.path.join(self.cache_dir, name))
+            except FileNotFoundError:
+                pass
+
+    def lookup(self, video_id, profile):
+        """Get the path of a cached file and pin it, or None on a miss"""
+        key = self._key(video_id, profile)
+        with self._lock:
+            if key not in self.entries:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries.move_to_end(key)
+            self._pins[key] += 1
+            name = self.entries[key][0]
+        path = os.path.join(self.cache_dir, name)
+        # Keep the modification time current so LRU order survives restarts
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return path
+
+    def contains(self, video_id, profile):
+        """Check whether a file is cached, without pinning it or counting a lookup"""
+        with self._lock:
+            return self._key(video_id, profile) in self.entries
+
+    def new_temp_path(self, video_id):
+        """Get a unique working path (without extension) for a download"""
+        return os.path.join(self.tmp_dir, f"{video_id}-{uuid.uuid4().hex}")
+
+    def discard_temp(self, temp_path):
+        """Remove every file a download wrote under temp_path"""
+        for path in glob.glob(f"{glob.escape(temp_path)}*"):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def publish(self, temp_file, video_id, profile):
+        """Atomically move a finished download into the cache and pin it"""
+        key = self._key(video_id, profile)
+        name = key + os.path.splitext(temp_file)[1]
+        path = os.path.join(self.cache_dir, name)
+        size = os.path.getsize(temp_file)
+
+        with self._lock:
+            old_name, old_size = self.entries.pop(key, (None, 0))
+            self.total_bytes -= old_size
+        if old_name and old_name != name:
+            try:
+                os.remove(os.path.join(self.cache_dir, old_name))
+            except FileNotFoundError:
+                pass
+        os.replace(temp_file, path)
+
+        with self._lock:
+            self.entries[key] = (name, size)
+            self.total_bytes += size
+            self._pins[key] += 1
+            self._evict()
+        os.utime(path)
+        return path
+
+    def release(self, path):
+        """Unpin a file returned by lookup or publish"""
+        key = os.path.splitext(os.path.basename(path))[0]
+        with self._lock:
+            self._pins[key] -= 1
+            if self._pins[key] <= 0:
+                del self._pins[key]
+            self._evict()
+
+    def get_stats(self):
+        """Get cache size and hit statistics"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "files": len(self.entries),
+                "bytes": self.total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0
+            }
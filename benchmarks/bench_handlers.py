@@ -0,0 +1,395 @@
+"""Load-test the bot's search and download handlers offline
+
+Replaces yt-dlp with a fake that answers searches and "downloads" files of
+a configurable size at a configurable speed, and the Bot API with a fake
+request backend with configurable latency and upload bandwidth. Synthetic
+/search updates and dl_ button presses are then fed through the real
+handlers in main.py, dispatched by a real Application, by a number of
+concurrent simulated users. Each user searches, waits for the results and
+picks one of them.
+
+    python benchmarks/bench_handlers.py [--sessions 2000] [--users 64] [--analytics jsonl]
+
+Reports throughput, p50/p95/p99 latency per update type, the average time
+per search and download stage, and what DataRecorder logging costs on the
+event loop and on its writer thread. The bot runs in a temporary directory
+with the file pipeline in native mode, rate limits off and logs going only
+to its bot.log; environment variables set before the run override any of
+these.
+"""
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+import yt_dlp
+from telegram import Update
+from telegram.ext import Application, TypeHandler
+from telegram.request import BaseRequest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+TOKEN = '123456:bench'
+RESULTS_PER_SEARCH = 5
+
+
+def jittered(seconds):
+    """Vary a latency by up to 50% either way"""
+    return seconds * random.uniform(0.5, 1.5)
+
+
+def video_id_for(query, index):
+    digest = hashlib.sha1(f"{query}/{index}".encode()).digest()
+    return base64.urlsafe_b64encode(digest).decode()[:11]
+
+
+class FakeYoutubeDL:
+    """Stands in for yt_dlp.YoutubeDL; searches and downloads without the network"""
+
+    # Set by main() before the bot module creates its pool
+    search_latency = 0.3
+    extract_latency = 0.3
+    file_bytes = 512 * 1024
+    download_rate = 50 * 1024 * 1024
+
+    def __init__(self, params=None):
+        self.params = dict(params or {})
+        self.params.setdefault('outtmpl', {'default': '%(title)s [%(id)s].%(ext)s'})
+        self._progress_hooks = []
+
+    def add_progress_hook(self, hook):
+        self._progress_hooks.append(hook)
+
+    format_selector = None
+
+    def build_format_selector(self, format_spec):
+        return format_spec
+
+    def get_info_extractor(self, name):
+        return None
+
+    def close(self):
+        pass
+
+    def extract_info(self, url, download=True):
+        if url.startswith('ytsearch'):
+            query = url.split(':', 1)[1]
+            time.sleep(jittered(self.search_latency))
+            return {'entries': [
+                {
+                    'id': video_id_for(query, i),
+                    'title': f"{query.title()} (Take {i + 1})",
+                    'uploader': f"Artist {abs(hash(query)) % 500}",
+                    'duration': 120 + (abs(hash((query, i))) % 300),
+                    'view_count': abs(hash((i, query))) % 10_000_000
+                }
+                for i in range(RESULTS_PER_SEARCH)
+            ]}
+
+        video_id = url.rsplit('v=', 1)[1]
+        time.sleep(jittered(self.extract_latency))
+        info = {
+            'id': video_id,
+            'title': f"Track {video_id}",
+            'uploader': "Bench Artist",
+            'duration': 240,
+            'ext': 'm4a'
+        }
+        if not download:
+            return info
+
+        path = self.params['outtmpl']['default'].replace('%(ext)s', 'm4a')
+        chunk = b'\0' * 65536
+        with open(path, 'wb') as f:
+            written = 0
+            while written < self.file_bytes:
+                size = min(len(chunk), self.file_bytes - written)
+                f.write(chunk[:size])
+                written += size
+                time.sleep(size / self.download_rate)
+                for hook in self._progress_hooks:
+                    hook({'status': 'downloading', 'downloaded_bytes': written, 'total_bytes': self.file_bytes})
+        for hook in self._progress_hooks:
+            hook({'status': 'finished', 'filename': path})
+        info['requested_downloads'] = [{'filepath': path}]
+        return info
+
+
+class FakeBotAPIRequest(BaseRequest):
+    """Answers Bot API calls in-process after a configurable delay"""
+
+    def __init__(self, latency=0.02, upload_rate=20 * 1024 * 1024):
+        self.latency = latency
+        self.upload_rate = upload_rate
+        self.calls = {}
+        self._message_ids = iter(range(1, 1 << 62))
+
+    @property
+    def read_timeout(self):
+        return None
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None,
+                         write_timeout=None, connect_timeout=None, pool_timeout=None):
+        api_method = url.rsplit('/', 1)[-1]
+        self.calls[api_method] = self.calls.get(api_method, 0) + 1
+        params = request_data.parameters if request_data else {}
+        delay = jittered(self.latency)
+        if request_data and request_data.contains_files:
+            uploaded = sum(len(part[1]) for part in request_data.multipart_data.values())
+            delay += uploaded / self.upload_rate
+        await asyncio.sleep(delay)
+
+        if api_method == 'getMe':
+            result = {'id': 123456, 'is_bot': True, 'first_name': 'Bench', 'username': 'bench_bot'}
+        elif api_method in ('sendMessage', 'sendAudio', 'editMessageText'):
+            result = {
+                'message_id': params.get('message_id') or next(self._message_ids),
+                'date': int(time.time()),
+                'chat': {'id': int(params['chat_id']), 'type': 'private'},
+                'text': params.get('text', '')
+            }
+            if api_method == 'sendAudio':
+                audio = str(params.get('audio', ''))
+                file_id = audio if not audio.startswith('attach://') else f"file-{next(self._message_ids)}"
+                result['audio'] = {'file_id': file_id, 'file_unique_id': file_id, 'duration': 240}
+        else:
+            result = True
+        return 200, json.dumps({'ok': True, 'result': result}).encode()
+
+
+def command_update(update_id, user_id, text):
+    command = text.split()[0]
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': {'id': user_id, 'is_bot': False, 'first_name': 'Bench'},
+            'text': text,
+            'entities': [{'type': 'bot_command', 'offset': 0, 'length': len(command)}]
+        }
+    }
+
+
+def callback_update(update_id, user_id, data):
+    return {
+        'update_id': update_id,
+        'callback_query': {
+            'id': str(update_id),
+            'from': {'id': user_id, 'is_bot': False, 'first_name': 'Bench'},
+            'chat_instance': str(user_id),
+            'data': data,
+            'message': {
+                'message_id': update_id,
+                'date': int(time.time()),
+                'chat': {'id': user_id, 'type': 'private'},
+                'from': {'id': 123456, 'is_bot': True, 'first_name': 'Bench'},
+                'text': "Select a song to download:"
+            }
+        }
+    }
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+def report(name, values, unit="ms", scale=1000):
+    if not values:
+        print(f"{name:<22} no samples")
+        return
+    print(
+        f"{name:<22} n {len(values):6d}   p50 {percentile(values, 0.50) * scale:9.2f} {unit}   "
+        f"p95 {percentile(values, 0.95) * scale:9.2f} {unit}   p99 {percentile(values, 0.99) * scale:9.2f} {unit}"
+    )
+
+
+def stage_averages(metrics_text):
+    """Get (stage, count, average seconds) from rendered stage_seconds metrics"""
+    sums, counts = {}, {}
+    for line in metrics_text.splitlines():
+        for suffix, target in (('_sum', sums), ('_count', counts)):
+            prefix = f"musicbot_stage_seconds{suffix}{{stage=\""
+            if line.startswith(prefix):
+                stage = line[len(prefix):line.index('"', len(prefix))]
+                target[stage] = float(line.rsplit(' ', 1)[1])
+    return [(stage, int(counts[stage]), sums[stage] / counts[stage]) for stage in counts if counts[stage]]
+
+
+class RecorderTimer:
+    """Times DataRecorder calls on the event loop and batch writes on its writer thread"""
+
+    def __init__(self, recorder):
+        self.calls = []
+        self.batch_seconds = 0.0
+        for name in ('log_search', 'log_download', 'log_error'):
+            setattr(recorder, name, self._time_call(getattr(recorder, name)))
+        writer = recorder.writer
+        write_batch = writer._write_batch
+
+        def timed_write_batch(pending):
+            started = time.perf_counter()
+            try:
+                write_batch(pending)
+            finally:
+                self.batch_seconds += time.perf_counter() - started
+        writer._write_batch = timed_write_batch
+
+    def _time_call(self, func):
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.calls.append(time.perf_counter() - started)
+        return timed
+
+
+async def run_load(bot, args, api):
+    done = {}
+
+    async def on_done(update, context):
+        future = done.pop(update.update_id, None)
+        if future is not None and not future.done():
+            future.set_result(time.perf_counter())
+
+    application = (
+        Application.builder()
+        .token(TOKEN)
+        .request(api)
+        .get_updates_request(FakeBotAPIRequest())
+        .concurrent_updates(bot.CONCURRENT_UPDATES)
+        .build()
+    )
+    bot.add_handlers(application)
+    # Handlers of a later group run once the update's handler has finished
+    application.add_handler(TypeHandler(Update, on_done), group=1)
+
+    update_ids = iter(range(1, 1 << 62))
+    latencies = {'search': [], 'download': []}
+    sessions = iter(range(args.sessions))
+
+    async def send(kind, payload):
+        update = Update.de_json(payload, application.bot)
+        future = asyncio.get_running_loop().create_future()
+        done[update.update_id] = future
+        started = time.perf_counter()
+        await application.update_queue.put(update)
+        latencies[kind].append(await future - started)
+
+    async def user(user_id):
+        for session in sessions:
+            query = f"song {random.randrange(args.distinct_queries)}"
+            await send('search', command_update(next(update_ids), user_id, f"/search {query}"))
+            if random.random() < args.click_rate:
+                video_id = video_id_for(query, random.randrange(RESULTS_PER_SEARCH))
+                await send('download', callback_update(next(update_ids), user_id, f"dl_{video_id}"))
+
+    async with application:
+        await application.start()
+        started = time.perf_counter()
+        await asyncio.gather(*(user(1000 + i) for i in range(args.users)))
+        elapsed = time.perf_counter() - started
+        await application.stop()
+    return latencies, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sessions', type=int, default=2000, help="searches to run, each maybe followed by a download")
+    parser.add_argument('--users', type=int, default=64, help="concurrent simulated users")
+    parser.add_argument('--distinct-queries', type=int, default=100, help="size of the query vocabulary")
+    parser.add_argument('--click-rate', type=float, default=1.0, help="fraction of searches followed by a download")
+    parser.add_argument('--search-latency', type=float, default=0.3, help="fake YouTube search time (s)")
+    parser.add_argument('--extract-latency', type=float, default=0.3, help="fake extraction time per download (s)")
+    parser.add_argument('--file-mb', type=float, default=0.5, help="size of every downloaded track")
+    parser.add_argument('--download-mbps', type=float, default=50, help="fake download speed (MB/s)")
+    parser.add_argument('--api-latency', type=float, default=0.02, help="fake Bot API round trip (s)")
+    parser.add_argument('--upload-mbps', type=float, default=20, help="fake Bot API upload speed (MB/s)")
+    parser.add_argument('--analytics', choices=('jsonl', 'sqlite'), default='jsonl', help="DataRecorder backend")
+    parser.add_argument('--seed', type=int, default=1, help="random seed of the workload")
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    FakeYoutubeDL.search_latency = args.search_latency
+    FakeYoutubeDL.extract_latency = args.extract_latency
+    FakeYoutubeDL.file_bytes = int(args.file_mb * 1024 * 1024)
+    FakeYoutubeDL.download_rate = args.download_mbps * 1024 * 1024
+    yt_dlp.YoutubeDL = FakeYoutubeDL
+
+    for name, value in {
+        'BOT_TOKEN': TOKEN,
+        'ANALYTICS_BACKEND': args.analytics,
+        'DELIVERY_PIPELINE': 'file',
+        'AUDIO_DELIVERY_MODE': 'native',
+        'DOWNLOAD_BACKEND': 'local',
+        'SEARCH_RATE_LIMIT': '0',
+        'DOWNLOAD_RATE_LIMIT': '0',
+        'SEARCH_CACHE_PERSIST': 'false',
+        'LOG_CONSOLE': 'false'
+    }.items():
+        os.environ.setdefault(name, value)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        import main as bot
+
+        api = FakeBotAPIRequest(args.api_latency, args.upload_mbps * 1024 * 1024)
+        recorder = RecorderTimer(bot.data_recorder)
+        latencies, elapsed = asyncio.run(run_load(bot, args, api))
+        flush_started = time.perf_counter()
+        bot.data_recorder.flush()
+        flush_seconds = time.perf_counter() - flush_started
+        stages = stage_averages(bot.metrics.render())
+        flights = bot.download_flights.get_stats()
+        caches = {
+            'search': bot.search_cache.get_stats()['hit_rate'],
+            'file_id': bot.file_id_cache.get_stats()['hit_rate'],
+            'audio': bot.audio_cache.get_stats()['hit_rate']
+        }
+        written, batches = bot.data_recorder.writer.written, bot.data_recorder.writer.batches
+        bot.shutdown()
+        os.chdir('/')
+
+    updates = sum(len(values) for values in latencies.values())
+    print(
+        f"{updates} updates from {args.users} users in {elapsed:.2f}s: "
+        f"{updates / elapsed:.1f} updates/s ({args.analytics} analytics)\n"
+    )
+    report("search", latencies['search'])
+    report("download", latencies['download'])
+    print(f"\n{'stage':<22} {'count':>7} {'average':>12}")
+    for stage, count, average in sorted(stages):
+        print(f"{stage:<22} {count:7d} {average * 1000:9.2f} ms")
+    print(
+        "\nCache hit rates: " + ", ".join(f"{name} {rate:.0%}" for name, rate in caches.items()) +
+        f"; {flights['started']} downloads, {flights['coalesced']} coalesced"
+    )
+    print("Bot API calls: " + ", ".join(f"{method} {count}" for method, count in sorted(api.calls.items())))
+
+    print("\nDataRecorder")
+    report("log call (event loop)", recorder.calls, unit="us", scale=1e6)
+    print(f"{'on the event loop':<22} {sum(recorder.calls) * 1000:9.2f} ms total")
+    print(
+        f"{'writer thread':<22} {recorder.batch_seconds * 1000:9.2f} ms for {written} records in {batches} batches "
+        f"({recorder.batch_seconds / max(written, 1) * 1e6:.1f} us/record)"
+    )
+    print(f"{'final flush':<22} {flush_seconds * 1000:9.2f} ms")
+
+
+if __name__ == '__main__':
+    main()
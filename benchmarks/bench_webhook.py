@@ -0,0 +1,269 @@
+"""Measure webhook update-handling throughput without Telegram
+
+Starts a fake Bot API server, runs the bot in webhook mode against it and
+posts synthetic command updates to the webhook. Reports webhook response
+times, end-to-end latency (update posted to reply received by the fake
+API) and throughput, then stops the bot while a final burst is in flight
+to check that accepted updates are drained on shutdown.
+
+    python benchmarks/bench_webhook.py [--updates 500] [--concurrency 32] [--command /help]
+
+Commands that don't contact YouTube (/start, /help, /stats) keep the run
+fully offline. The bot runs in a temporary directory, so its data/ and
+downloads/ don't touch the working tree.
+"""
+import argparse
+import json
+import os
+import secrets
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import parse_qsl
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+MAIN = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'main.py')
+TOKEN = '123456:bench'
+
+
+class FakeBotAPI(ThreadingHTTPServer):
+    """Answers Bot API calls with canned responses and records when replies arrive"""
+
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), FakeBotAPIHandler)
+        self.replies = {}
+        self.calls = {}
+        self.condition = threading.Condition()
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/bot"
+
+    def record(self, method, params):
+        with self.condition:
+            self.calls[method] = self.calls.get(method, 0) + 1
+            if method == 'sendMessage':
+                self.replies.setdefault(int(params['chat_id']), time.perf_counter())
+            self.condition.notify_all()
+
+    def wait_for_replies(self, chat_ids, timeout):
+        """Wait until every chat in chat_ids got a reply; returns the ones that did"""
+        deadline = time.monotonic() + timeout
+        with self.condition:
+            while not chat_ids <= self.replies.keys() and time.monotonic() < deadline:
+                self.condition.wait(deadline - time.monotonic())
+            return chat_ids & self.replies.keys()
+
+
+class FakeBotAPIHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        method = self.path.rsplit('/', 1)[-1]
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.headers.get_content_type() == 'application/json':
+            params = json.loads(body or b'{}')
+        else:
+            params = dict(parse_qsl(body.decode()))
+        self.server.record(method, params)
+
+        if method == 'getMe':
+            result = {'id': 123456, 'is_bot': True, 'first_name': 'Bench', 'username': 'bench_bot'}
+        elif method == 'sendMessage':
+            result = {
+                'message_id': 1,
+                'date': int(time.time()),
+                'chat': {'id': int(params['chat_id']), 'type': 'private'},
+                'text': params.get('text', '')
+            }
+        else:
+            result = True
+
+        payload = json.dumps({'ok': True, 'result': result}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def make_update(update_id, user_id, command):
+    """Build a private-chat command update; every update gets its own chat to match replies"""
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': update_id, 'type': 'private'},
+            'from': {'id': user_id, 'is_bot': False, 'first_name': 'Bench'},
+            'text': command,
+            'entities': [{'type': 'bot_command', 'offset': 0, 'length': len(command.split()[0])}]
+        }
+    }
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+def report(name, values):
+    print(
+        f"{name:<20} p50 {percentile(values, 0.50):8.2f} ms   "
+        f"p95 {percentile(values, 0.95):8.2f} ms   p99 {percentile(values, 0.99):8.2f} ms"
+    )
+
+
+def post_updates(webhook, secret, updates, concurrency):
+    """Post updates concurrently; returns {update_id: (status, post start, post time ms)}
+
+    The status is None when the bot refused the connection.
+    """
+    local = threading.local()
+
+    def post(update):
+        if not hasattr(local, 'session'):
+            local.session = requests.Session()
+        started = time.perf_counter()
+        try:
+            status = local.session.post(
+                webhook,
+                json=update,
+                headers={'X-Telegram-Bot-Api-Secret-Token': secret},
+                timeout=30
+            ).status_code
+        except requests.ConnectionError:
+            status = None
+        return update['update_id'], (status, started, (time.perf_counter() - started) * 1000)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return dict(executor.map(post, updates))
+
+
+def wait_for_port(port, process, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Bot exited with code {process.returncode} before serving the webhook")
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError("Timed out waiting for the webhook to start")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--updates', type=int, default=500, help="updates to post")
+    parser.add_argument('--concurrency', type=int, default=32, help="concurrent webhook requests")
+    parser.add_argument('--users', type=int, default=50, help="distinct users sending updates")
+    parser.add_argument('--command', default='/help', help="command text of every update")
+    parser.add_argument('--drain-burst', type=int, default=100, help="updates in flight when the bot is stopped")
+    args = parser.parse_args()
+
+    api = FakeBotAPI()
+    threading.Thread(target=api.serve_forever, daemon=True).start()
+
+    port = free_port()
+    secret = secrets.token_urlsafe(24)
+    webhook = f"http://127.0.0.1:{port}/telegram"
+    env = dict(
+        os.environ,
+        BOT_TOKEN=TOKEN,
+        BOT_API_BASE_URL=api.base_url,
+        UPDATE_MODE='webhook',
+        WEBHOOK_URL='https://bench.invalid/telegram',
+        WEBHOOK_LISTEN='127.0.0.1',
+        WEBHOOK_PORT=str(port),
+        WEBHOOK_PATH='telegram',
+        WEBHOOK_SECRET=secret,
+        SEARCH_RATE_LIMIT='0',
+        DOWNLOAD_RATE_LIMIT='0'
+    )
+
+    with tempfile.TemporaryDirectory() as workdir:
+        bot = subprocess.Popen(
+            [sys.executable, os.path.abspath(MAIN)],
+            cwd=workdir,
+            env=env,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL
+        )
+        try:
+            wait_for_port(port, bot)
+
+            rejected = requests.post(
+                webhook,
+                json=make_update(0, 1, args.command),
+                headers={'X-Telegram-Bot-Api-Secret-Token': 'wrong'},
+                timeout=10
+            )
+            print(f"Wrong secret token: HTTP {rejected.status_code}")
+
+            # Warm up connections and handler code paths
+            post_updates(webhook, secret, [make_update(i, i % args.users + 1, args.command) for i in range(1, 21)], 4)
+            api.wait_for_replies(set(range(1, 21)), timeout=30)
+
+            first = 1000
+            updates = [make_update(first + i, i % args.users + 1, args.command) for i in range(args.updates)]
+            started = time.perf_counter()
+            posted = post_updates(webhook, secret, updates, args.concurrency)
+            answered = api.wait_for_replies(set(posted), timeout=120)
+            finished = max(api.replies[update_id] for update_id in answered) if answered else started
+
+            print(f"\n{len(answered)}/{len(posted)} updates answered, concurrency {args.concurrency}")
+            if not answered:
+                raise RuntimeError("The bot didn't answer any update")
+            report("webhook response", [post_time for _, _, post_time in posted.values()])
+            report("end-to-end", [
+                (api.replies[update_id] - posted[update_id][1]) * 1000 for update_id in answered
+            ])
+            print(f"{'throughput':<20} {len(answered) / max(finished - started, 1e-9):8.1f} updates/s")
+
+            # Stop the bot while a burst of updates is still being posted
+            first = 100000
+            burst = [make_update(first + i, i % args.users + 1, args.command) for i in range(args.drain_burst)]
+            poster = ThreadPoolExecutor(max_workers=1)
+            burst_future = poster.submit(post_updates, webhook, secret, burst, args.concurrency)
+            time.sleep(0.05)
+            stopping = time.perf_counter()
+            bot.send_signal(signal.SIGINT)
+            burst_posted = burst_future.result()
+            bot.wait(timeout=120)
+            stopped = time.perf_counter()
+            poster.shutdown()
+
+            accepted = {update_id for update_id, (status, _, _) in burst_posted.items() if status == 200}
+            drained = api.wait_for_replies(accepted, timeout=0)
+            print(
+                f"\nShutdown drained {len(drained)}/{len(accepted)} accepted updates "
+                f"({len(burst) - len(accepted)} refused after the stop) in {stopped - stopping:.2f}s"
+            )
+        finally:
+            if bot.poll() is None:
+                bot.kill()
+            api.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""Measure the per-request setup cost removed by pooled YoutubeDL instances and HTTP sessions
+
+Runs offline: the YoutubeDL part only builds instances and initializes the
+YouTube extractor, and the HTTP part talks to a local keep-alive server.
+
+    python benchmarks/bench_ydl_pool.py [--requests 50]
+"""
+import argparse
+import os
+import ssl
+import statistics
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+import yt_dlp
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from ydl_pool import YoutubeDLPool
+from http_session import create_session
+
+YDL_OPTS = {'format': 'bestaudio/best', 'quiet': True, 'no_warnings': True}
+
+
+class OEmbedHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        body = b'{"title": "Song", "author_name": "Artist"}'
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def timed(func, count):
+    """Run func count times and return the per-call times in milliseconds"""
+    times = []
+    for _ in range(count):
+        started = time.perf_counter()
+        func()
+        times.append((time.perf_counter() - started) * 1000)
+    return times
+
+
+def report(name, times):
+    print(f"{name:<34} mean {statistics.mean(times):8.3f} ms   median {statistics.median(times):8.3f} ms")
+
+
+def fresh_ydl():
+    with yt_dlp.YoutubeDL(dict(YDL_OPTS)) as ydl:
+        ydl.get_info_extractor('Youtube')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=50, help="requests per measurement")
+    args = parser.parse_args()
+
+    print("YoutubeDL setup per request")
+    report("new YoutubeDL + extractor init", timed(fresh_ydl, args.requests))
+
+    started = time.perf_counter()
+    pool = YoutubeDLPool({'metadata': (4, YDL_OPTS)})
+    print(f"{'pool warm-up (4 instances, once)':<34} {(time.perf_counter() - started) * 1000:8.3f} ms")
+
+    def leased_ydl():
+        with pool.lease('metadata') as ydl:
+            ydl.get_info_extractor('Youtube')
+
+    report("pooled lease", timed(leased_ydl, args.requests))
+    pool.close()
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), OEmbedHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/oembed"
+
+    print("\noEmbed request to a local server")
+    report("requests.get (new connection)", timed(lambda: requests.get(url, timeout=10).json(), args.requests))
+    session = create_session(ssl.create_default_context())
+    report("shared session (keep-alive)", timed(lambda: session.get(url, timeout=10).json(), args.requests))
+    print("Real oEmbed calls also pay a TLS handshake per new connection, which the session avoids.")
+
+    session.close()
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
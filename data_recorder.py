@@ -1,92 +1,105 @@
 import json
 import os
+import atexit
+import shutil
+import time
 from datetime import datetime
 import logging
+from log_writer import BatchedLogWriter
+from analytics_db import AnalyticsDB
+from stats_aggregator import StatsAggregator
 
 class DataRecorder:
-    def __init__(self, data_dir="data"):
+    def __init__(self, data_dir="data", batch_size=100, flush_interval=1.0, stats_interval=60.0, backend="jsonl"):
+        if backend not in ("jsonl", "sqlite"):
+            raise ValueError(f"Invalid analytics backend: {backend}")
         self.data_dir = data_dir
-        self.search_log_file = os.path.join(data_dir, "search_log.json")
-        self.download_log_file = os.path.join(data_dir, "download_log.json")
-        self.error_log_file = os.path.join(data_dir, "error_log.json")
+        self.backend = backend
+        self.search_log_file = os.path.join(data_dir, "search_log.jsonl")
+        self.download_log_file = os.path.join(data_dir, "download_log.jsonl")
+        self.error_log_file = os.path.join(data_dir, "error_log.jsonl")
+        self.analytics_file = os.path.join(data_dir, "analytics.db")
         self.stats_file = os.path.join(data_dir, "stats.json")
+        self.log_files = {
+            "searches": self.search_log_file,
+            "downloads": self.download_log_file,
+            "errors": self.error_log_file
+        }
         
         # Create data directory if it doesn't exist
         os.makedirs(data_dir, exist_ok=True)
         
+        # Records propagate to the handlers configured by the application
+        self.logger = logging.getLogger(__name__)
+        
         # Initialize log files if they don't exist
         self._initialize_log_files()
         
-        # Setup logging to both file and console
-        self.logger = logging.getLogger(__name__)
-        if not self.logger.handlers:
-            file_handler = logging.FileHandler(os.path.join(data_dir, "bot.log"))
-            console_handler = logging.StreamHandler()
-            
-            # Create formatter
-            formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-            file_handler.setFormatter(formatter)
-            console_handler.setFormatter(formatter)
-            
-            # Add handlers
-            self.logger.addHandler(file_handler)
-            self.logger.addHandler(console_handler)
-            self.logger.setLevel(logging.INFO)
+        # Log records are written in batches by a background thread, either
+        # appended to the JSON Lines logs or inserted into the SQLite store.
+        # A new SQLite store starts with the history from the JSON Lines logs.
+        if backend == "sqlite":
+            self.analytics = AnalyticsDB(
+                self.analytics_file,
+                batch_size=batch_size,
+                flush_interval=flush_interval,
+                import_logs=self.log_files
+            )
+            self.writer = self.analytics
+        else:
+            self.analytics = None
+            self.writer = BatchedLogWriter(batch_size=batch_size, flush_interval=flush_interval)
+        
+        # Statistics live in memory and are checkpointed to stats.json
+        self.stats = StatsAggregator(self.stats_file, checkpoint_interval=stats_interval)
+        atexit.register(self.close)
 
     def _initialize_log_files(self):
-        """Initialize log files with empty lists if they don't exist"""
+        """Initialize log files, migrating old JSON array logs to JSON Lines"""
         for file_path in [self.search_log_file, self.download_log_file, self.error_log_file]:
+            self._migrate_json_log(file_path)
             if not os.path.exists(file_path):
-                with open(file_path, 'w') as f:
-                    json.dump([], f)
-        
-        if not os.path.exists(self.stats_file):
-            initial_stats = {
-                "total_searches": 0,
-                "total_downloads": 0,
-                "total_errors": 0,
-                "popular_searches": {},
-                "popular_artists": {},
-                "last_updated": datetime.now().isoformat()
-            }
-            with open(self.stats_file, 'w') as f:
-                json.dump(initial_stats, f, indent=4)
+                open(file_path, 'a').close()
 
-    def _append_to_log(self, file_path, data):
-        """Append data to a JSON log file"""
-        try:
-            with open(file_path, 'r') as f:
-                log_data = json.load(f)
-            
-            log_data.append(data)
-            
-            with open(file_path, 'w') as f:
-                json.dump(log_data, f, indent=4)
-        except Exception as e:
-            self.logger.error(f"Error appending to log file {file_path}: {str(e)}")
+    def _migrate_json_log(self, file_path):
+        """Convert a legacy JSON array log (e.g. search_log.json) to JSON Lines
+
+        The converted log is written to a temporary file, the legacy log is
+        renamed and then the temporary file replaces the JSON Lines log, so a
+        migration interrupted at any point is redone or finished on the next
+        start without duplicating records.
+        """
+        legacy_file = os.path.splitext(file_path)[0] + ".json"
+        tmp_file = f"{file_path}.tmp"
+        if not os.path.exists(legacy_file):
+            # Finish a migration interrupted after the legacy log was renamed
+            if os.path.exists(tmp_file):
+                os.replace(tmp_file, file_path)
+            return
 
-    def _update_stats(self, stat_type, data=None):
-        """Update statistics"""
         try:
-            with open(self.stats_file, 'r') as f:
-                stats = json.load(f)
-            
-            stats[stat_type] += 1
+            with open(legacy_file, 'r') as f:
+                records = json.load(f)
             
-            if data:
-                if stat_type == "popular_searches":
-                    query = data.get("query", "").lower()
-                    stats["popular_searches"][query] = stats["popular_searches"].get(query, 0) + 1
-                elif stat_type == "popular_artists":
-                    artist = data.get("artist", "").lower()
-                    stats["popular_artists"][artist] = stats["popular_artists"].get(artist, 0) + 1
+            with open(tmp_file, 'w') as f:
+                if os.path.exists(file_path):
+                    with open(file_path, 'r') as existing:
+                        shutil.copyfileobj(existing, f)
+                for record in records:
+                    f.write(json.dumps(record) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
             
-            stats["last_updated"] = datetime.now().isoformat()
-            
-            with open(self.stats_file, 'w') as f:
-                json.dump(stats, f, indent=4)
+            # Keep the old file around, but never migrate it twice
+            os.replace(legacy_file, legacy_file + ".migrated")
+            os.replace(tmp_file, file_path)
+            self.logger.info(f"Migrated {len(records)} records from {legacy_file} to {file_path}")
         except Exception as e:
-            self.logger.error(f"Error updating stats: {str(e)}")
+            self.logger.error(f"Error migrating log file {legacy_file}: {str(e)}")
+
+    def _append_to_log(self, log, data):
+        """Queue a record for the searches, downloads or errors log"""
+        self.writer.write(log if self.analytics else self.log_files[log], data)
 
     def log_search(self, user_id, query, results_count):
         """Log a search operation"""
@@ -96,8 +109,8 @@ class DataRecorder:
             "query": query,
             "results_count": results_count
         }
-        self._append_to_log(self.search_log_file, search_data)
-        self._update_stats("total_searches", search_data)
+        self._append_to_log("searches", search_data)
+        self.stats.record_search(query)
         self.logger.info(f"Search logged: {query} by user {user_id}")
 
     def log_download(self, user_id, video_id, title, artist):
@@ -109,8 +122,8 @@ class DataRecorder:
             "title": title,
             "artist": artist
         }
-        self._append_to_log(self.download_log_file, download_data)
-        self._update_stats("total_downloads", download_data)
+        self._append_to_log("downloads", download_data)
+        self.stats.record_download(artist)
         self.logger.info(f"Download logged: {title} by {artist} for user {user_id}")
 
     def log_error(self, user_id, error_type, error_message, context=None):
@@ -122,15 +135,45 @@ class DataRecorder:
             "error_message": error_message,
             "context": context
         }
-        self._append_to_log(self.error_log_file, error_data)
-        self._update_stats("total_errors")
+        self._append_to_log("errors", error_data)
+        self.stats.record_error()
         self.logger.error(f"Error logged: {error_type} - {error_message}")
 
-    def get_stats(self):
-        """Get current statistics"""
+    def get_stats(self, window=None, top_n=5):
+        """Get current statistics, optionally ranking popularity over a recent window"""
         try:
-            with open(self.stats_file, 'r') as f:
-                return json.load(f)
+            return self.stats.snapshot(window, top_n)
         except Exception as e:
             self.logger.error(f"Error reading stats: {str(e)}")
-            return None 
\ No newline at end of file
+            return None
+
+    def query_stats(self, since=None, user_id=None, top_n=5, hours=24):
+        """Get activity since a unix time from the SQLite store, optionally for one user
+
+        The hourly breakdown covers at most the last `hours` hours of the
+        range. Returns None unless the sqlite backend is enabled.
+        """
+        if not self.analytics:
+            return None
+        try:
+            hourly_since = max(since or 0.0, time.time() - hours * 3600)
+            return {
+                "totals": self.analytics.summary(since),
+                "active_users": self.analytics.active_users(since),
+                "errors_by_type": self.analytics.errors_by_type(since)[:top_n],
+                "hourly": self.analytics.hourly(hourly_since),
+                "hourly_errors": self.analytics.hourly_errors(hourly_since),
+                "user": self.analytics.summary(since, user_id) if user_id is not None else None
+            }
+        except Exception as e:
+            self.logger.error(f"Error querying analytics: {str(e)}")
+            return None
+
+    def flush(self):
+        """Write all queued log records to disk"""
+        self.writer.flush()
+
+    def close(self):
+        """Flush queued log records and write a final stats checkpoint"""
+        self.writer.close()
+        self.stats.close()
@@ -0,0 +1,120 @@
+import json
+import os
+import logging
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+
+class FileIdCache:
+    """Persistent map of (video_id, codec, quality) to uploaded Telegram file_ids
+
+    Changes are appended to a JSON Lines journal so recording an upload
+    costs O(1); the journal is replayed and compacted on startup.
+    """
+
+    def __init__(self, cache_file=os.path.join("data", "file_id_cache.jsonl")):
+        self.cache_file = cache_file
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+        os.makedirs(os.path.dirname(cache_file) or ".", exist_ok=True)
+        self._load()
+
+    @staticmethod
+    def _key(video_id, codec, quality):
+        return f"{video_id}:{codec}:{quality}"
+
+    def _load(self):
+        """Replay the journal and rewrite it with only live entries"""
+        if not os.path.exists(self.cache_file):
+            return
+
+        lines = 0
+        try:
+            with open(self.cache_file, 'r') as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    lines += 1
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # A crash can leave a truncated last line behind
+                        continue
+                    key = record.get("key")
+                    if record.get("invalidated"):
+                        self.entries.pop(key, None)
+                    elif key and record.get("file_id"):
+                        self.entries[key] = record
+        except Exception as e:
+            logger.error(f"Error loading file_id cache {self.cache_file}: {str(e)}")
+            return
+
+        if lines > len(self.entries):
+            self._compact()
+        logger.info(f"Loaded {len(self.entries)} cached file_ids")
+
+    def _compact(self):
+        """Atomically rewrite the journal with the current entries"""
+        tmp_file = f"{self.cache_file}.tmp"
+        try:
+            with open(tmp_file, 'w') as f:
+                for record in self.entries.values():
+                    f.write(json.dumps(record) + "\n")
+            os.replace(tmp_file, self.cache_file)
+        except Exception as e:
+            logger.error(f"Error compacting file_id cache {self.cache_file}: {str(e)}")
+
+    def _append(self, record):
+        try:
+            with open(self.cache_file, 'a') as f:
+                f.write(json.dumps(record) + "\n")
+        except Exception as e:
+            logger.error(f"Error writing file_id cache {self.cache_file}: {str(e)}")
+
+    def get(self, video_id, codec, quality):
+        """Get the cached entry for a track, or None"""
+        entry = self.entries.get(self._key(video_id, codec, quality))
+        if entry:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return entry
+
+    def contains(self, video_id, codec, quality):
+        """Check whether a track is cached, without counting a lookup"""
+        return self._key(video_id, codec, quality) in self.entries
+
+    def set(self, video_id, codec, quality, file_id, title, artist):
+        """Record the file_id Telegram assigned to an uploaded track"""
+        record = {
+            "key": self._key(video_id, codec, quality),
+            "file_id": file_id,
+            "title": title,
+            "artist": artist,
+            "timestamp": datetime.now().isoformat()
+        }
+        self.entries[record["key"]] = record
+        self._append(record)
+
+    def invalidate(self, video_id, codec, quality):
+        """Forget a file_id that Telegram no longer accepts"""
+        key = self._key(video_id, codec, quality)
+        if self.entries.pop(key, None) is not None:
+            self.invalidations += 1
+            self._append({"key": key, "invalidated": True})
+
+    def get_stats(self):
+        """Get cache size and hit statistics"""
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "hit_rate": self.hits / lookups if lookups else 0.0
+        }
@@ -0,0 +1,171 @@
+import heapq
+import time
+
+# Window name -> (span in seconds, number of buckets)
+WINDOWS = {
+    "hour": (3600, 12),
+    "day": (86400, 24),
+    "week": (7 * 86400, 7)
+}
+
+
+class SpaceSaving:
+    """Streaming top-k counter using the Space-Saving algorithm
+
+    At most capacity items are tracked. A new item arriving while the
+    counter is full replaces the item with the smallest count and inherits
+    that count, so counts are overestimated by at most the evicted count,
+    which is kept in errors. Items are ranked by their guaranteed count
+    (count minus error), so a newcomer that merely inherited a large count
+    doesn't crowd out items that were really seen often. Keep capacity
+    well above the number of items shown, so the real heavy hitters are
+    never evicted.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.counts = {}
+        self.errors = {}
+        # Min-heap of (count, item); entries go stale when counts change
+        self._heap = []
+
+    def add(self, item, count=1, error=0):
+        """Count an occurrence of item, or count occurrences overestimated by error"""
+        if item in self.counts:
+            self.counts[item] += count
+            self.errors[item] += error
+        elif len(self.counts) < self.capacity:
+            self.counts[item] = count
+            self.errors[item] = error
+        else:
+            min_item, min_count = self._pop_min()
+            del self.counts[min_item]
+            del self.errors[min_item]
+            self.counts[item] = min_count + count
+            self.errors[item] = min_count + error
+        self._push(item)
+
+    def _push(self, item):
+        heapq.heappush(self._heap, (self.counts[item], item))
+        if len(self._heap) > 4 * self.capacity:
+            self._heap = [(count, item) for item, count in self.counts.items()]
+            heapq.heapify(self._heap)
+
+    def _pop_min(self):
+        while True:
+            count, item = heapq.heappop(self._heap)
+            if self.counts.get(item) == count:
+                return item, count
+
+    def top(self, n):
+        """Get the n items with the highest guaranteed counts as (item, count) pairs"""
+        guaranteed = ((item, count - self.errors[item]) for item, count in self.counts.items())
+        return heapq.nlargest(n, guaranteed, key=lambda x: x[1])
+
+    def merge(self, other):
+        """Add every count from another sketch into this one, keeping its errors"""
+        for item, count in other.counts.items():
+            self.add(item, count, other.errors[item])
+
+    def to_dict(self):
+        return {"counts": self.counts, "errors": self.errors}
+
+    @classmethod
+    def from_dict(cls, capacity, data):
+        sketch = cls(capacity)
+        counts = data.get("counts", {})
+        for item, count in heapq.nlargest(capacity, counts.items(), key=lambda x: x[1]):
+            sketch.counts[item] = count
+            sketch.errors[item] = data.get("errors", {}).get(item, 0)
+        sketch._heap = [(count, item) for item, count in sketch.counts.items()]
+        heapq.heapify(sketch._heap)
+        return sketch
+
+
+class _BucketRing:
+    """Space-Saving sketches over consecutive time buckets of one window"""
+
+    def __init__(self, span, bucket_count, capacity):
+        self.width = span / bucket_count
+        self.bucket_count = bucket_count
+        self.capacity = capacity
+        self.buckets = {}
+
+    def _prune(self, current):
+        oldest = current - self.bucket_count + 1
+        for index in [index for index in self.buckets if index < oldest]:
+            del self.buckets[index]
+
+    def add(self, item, now):
+        current = int(now // self.width)
+        bucket = self.buckets.get(current)
+        if bucket is None:
+            self._prune(current)
+            bucket = self.buckets[current] = SpaceSaving(self.capacity)
+        bucket.add(item)
+
+    def combined(self, now):
+        self._prune(int(now // self.width))
+        merged = SpaceSaving(self.capacity)
+        for bucket in self.buckets.values():
+            merged.merge(bucket)
+        return merged
+
+
+class WindowedTopK:
+    """Fixed-size top-k tracking over all time and recent time windows
+
+    Memory and query cost depend only on capacity and the number of
+    buckets per window, never on how many distinct items were seen.
+    """
+
+    def __init__(self, capacity=1000, windows=WINDOWS):
+        self.capacity = capacity
+        self.all_time = SpaceSaving(capacity)
+        self.windows = {
+            name: _BucketRing(span, bucket_count, capacity)
+            for name, (span, bucket_count) in windows.items()
+        }
+
+    def add(self, item, now=None):
+        """Count an occurrence of item"""
+        now = time.time() if now is None else now
+        self.all_time.add(item)
+        for ring in self.windows.values():
+            ring.add(item, now)
+
+    def top(self, n, window=None, now=None):
+        """Get the top n (item, count) pairs, optionally for a recent window"""
+        if window is None:
+            return self.all_time.top(n)
+        if window not in self.windows:
+            raise ValueError(f"Unknown window: {window}")
+        now = time.time() if now is None else now
+        return self.windows[window].combined(now).top(n)
+
+    def to_dict(self):
+        return {
+            "all_time": self.all_time.to_dict(),
+            "windows": {
+                name: {str(index): bucket.to_dict() for index, bucket in ring.buckets.items()}
+                for name, ring in self.windows.items()
+            }
+        }
+
+    @classmethod
+    def from_dict(cls, data, capacity=1000):
+        """Restore a sketch saved with to_dict, or seed one from plain {item: count} data"""
+        sketch = cls(capacity)
+        if "all_time" not in data:
+            # Statistics written before heavy-hitter tracking kept exact counts
+            sketch.all_time = SpaceSaving.from_dict(capacity, {"counts": data})
+            return sketch
+
+        sketch.all_time = SpaceSaving.from_dict(capacity, data["all_time"])
+        for name, buckets in data.get("windows", {}).items():
+            ring = sketch.windows.get(name)
+            if ring is None:
+                continue
+            for index, bucket in buckets.items():
+                ring.buckets[int(index)] = SpaceSaving.from_dict(capacity, bucket)
+        return sketch
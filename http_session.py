@@ -0,0 +1,27 @@
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class SSLContextAdapter(HTTPAdapter):
+    """HTTP adapter whose connection pools use a given SSL context"""
+
+    def __init__(self, ssl_context, **kwargs):
+        self.ssl_context = ssl_context
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs['ssl_context'] = self.ssl_context
+        return super().init_poolmanager(*args, **kwargs)
+
+    def proxy_manager_for(self, *args, **kwargs):
+        kwargs['ssl_context'] = self.ssl_context
+        return super().proxy_manager_for(*args, **kwargs)
+
+
+def create_session(ssl_context, pool_size=32):
+    """Create a keep-alive HTTP session that verifies TLS with ssl_context"""
+    session = requests.Session()
+    adapter = SSLContextAdapter(ssl_context, pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size))
+    return session
@@ -0,0 +1,175 @@
+import os
+import sqlite3
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class DurableJobQueue:
+    """SQLite-backed download job queue shared by the bot and its worker processes
+
+    Workers claim jobs with a time-limited lease and renew it while they
+    work. A job whose lease runs out, because its worker crashed or hung,
+    is handed to the next worker that asks. Finished and failed jobs stay
+    in the queue until the bot collects them to update its caches and logs.
+    Any process on any host that can lock the database file can take part.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            video_id TEXT NOT NULL,
+            chat_id INTEGER NOT NULL,
+            message_id INTEGER,
+            user_id INTEGER,
+            status TEXT NOT NULL DEFAULT 'queued',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            worker TEXT,
+            lease_expires REAL,
+            available_at REAL NOT NULL DEFAULT 0,
+            created REAL NOT NULL,
+            updated REAL NOT NULL,
+            file_id TEXT,
+            title TEXT,
+            artist TEXT,
+            error TEXT,
+            collected INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE INDEX IF NOT EXISTS jobs_claim ON jobs (status, lease_expires, id);
+        CREATE INDEX IF NOT EXISTS jobs_collect ON jobs (collected, status);
+    """
+
+    def __init__(self, db_file=os.path.join("data", "jobs.db"), lease_seconds=300, max_attempts=3):
+        self.db_file = db_file
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(db_file) or ".", exist_ok=True)
+        # Transactions are managed explicitly so claims can take the write lock up front
+        self._db = sqlite3.connect(db_file, timeout=30, isolation_level=None, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(self.SCHEMA)
+
+    def _write(self, sql, params):
+        with self._lock:
+            return self._db.execute(sql, params)
+
+    def enqueue(self, video_id, chat_id, message_id=None, user_id=None):
+        """Add a download job and return its id"""
+        now = time.time()
+        cursor = self._write(
+            "INSERT INTO jobs (video_id, chat_id, message_id, user_id, created, updated) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (video_id, chat_id, message_id, user_id, now, now)
+        )
+        return cursor.lastrowid
+
+    def claim(self, worker):
+        """Lease the oldest available job to worker, or return None
+
+        Jobs whose lease expired are claimable again. A claimed job whose
+        attempts exceed max_attempts should be failed, not retried.
+        """
+        now = time.time()
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._db.execute(
+                    "SELECT * FROM jobs WHERE (status = 'queued' AND available_at <= ?) "
+                    "OR (status = 'leased' AND lease_expires < ?) ORDER BY id LIMIT 1",
+                    (now, now)
+                ).fetchone()
+                if row is not None:
+                    self._db.execute(
+                        "UPDATE jobs SET status = 'leased', worker = ?, lease_expires = ?, "
+                        "attempts = attempts + 1, updated = ? WHERE id = ?",
+                        (worker, now + self.lease_seconds, now, row["id"])
+                    )
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+
+        if row is None:
+            return None
+        job = dict(row)
+        job["attempts"] += 1
+        if job["status"] == "leased":
+            logger.warning(f"Lease of job {job['id']} held by {job['worker']} expired, retrying")
+        return job
+
+    def renew(self, job_id, worker):
+        """Extend a lease; returns False if the job was taken over by another worker"""
+        now = time.time()
+        cursor = self._write(
+            "UPDATE jobs SET lease_expires = ?, updated = ? "
+            "WHERE id = ? AND worker = ? AND status = 'leased'",
+            (now + self.lease_seconds, now, job_id, worker)
+        )
+        return cursor.rowcount == 1
+
+    def complete(self, job_id, worker, file_id=None, title=None, artist=None):
+        """Mark a leased job as delivered"""
+        self._write(
+            "UPDATE jobs SET status = 'done', file_id = ?, title = ?, artist = ?, "
+            "lease_expires = NULL, updated = ? WHERE id = ? AND worker = ?",
+            (file_id, title, artist, time.time(), job_id, worker)
+        )
+
+    def fail(self, job_id, worker, error, retry_after=None):
+        """Give up on a leased job, or queue it again in retry_after seconds"""
+        now = time.time()
+        self._write(
+            "UPDATE jobs SET status = ?, error = ?, available_at = ?, lease_expires = NULL, updated = ? "
+            "WHERE id = ? AND worker = ?",
+            (
+                'failed' if retry_after is None else 'queued',
+                error,
+                now + (retry_after or 0),
+                now,
+                job_id,
+                worker
+            )
+        )
+
+    def collect(self, limit=100):
+        """Return finished and failed jobs that weren't collected yet, marking them collected"""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT * FROM jobs WHERE collected = 0 AND status IN ('done', 'failed') "
+                "ORDER BY id LIMIT ?",
+                (limit,)
+            ).fetchall()
+            if rows:
+                self._db.execute(
+                    f"UPDATE jobs SET collected = 1 WHERE id IN ({', '.join('?' * len(rows))})",
+                    [row["id"] for row in rows]
+                )
+        return [dict(row) for row in rows]
+
+    def purge(self, older_than):
+        """Delete collected jobs last updated more than older_than seconds ago"""
+        self._write(
+            "DELETE FROM jobs WHERE collected = 1 AND updated < ?",
+            (time.time() - older_than,)
+        )
+
+    def get_stats(self):
+        """Get the number of jobs in each state"""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT status, COUNT(*) FROM jobs WHERE collected = 0 GROUP BY status"
+            ).fetchall()
+        stats = {"queued": 0, "leased": 0, "done": 0, "failed": 0}
+        stats.update({status: count for status, count in rows})
+        return stats
+
+    def close(self):
+        """Close the database connection"""
+        with self._lock:
+            self._db.close()
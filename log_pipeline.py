@@ -0,0 +1,91 @@
+import atexit
+import copy
+import json
+import queue
+import sys
+import logging
+import logging.handlers
+from datetime import datetime
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats each record as a single-line JSON object"""
+
+    def format(self, record):
+        entry = {
+            "timestamp": datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "thread": record.threadName
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that keeps a record's traceback apart from its message"""
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.message = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = record.exc_text or logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class LogPipeline:
+    """Routes every log record through a queue to a background writer thread
+
+    The root logger gets a single QueueHandler, so logging from a handler
+    or worker thread only enqueues the record. A QueueListener thread
+    formats the records and writes them to the log file and the console.
+    The log file is rotated once it reaches max_bytes, or on a schedule
+    when rotate_when is given (e.g. 'midnight' or 'H', see
+    TimedRotatingFileHandler), keeping backup_count old files.
+    """
+
+    def __init__(self, log_file="bot.log", level="INFO", json_format=False,
+                 max_bytes=50 * 1024 * 1024, backup_count=5, rotate_when=None, console=True):
+        if rotate_when:
+            file_handler = logging.handlers.TimedRotatingFileHandler(
+                log_file, when=rotate_when, backupCount=backup_count, encoding='utf-8'
+            )
+        else:
+            file_handler = logging.handlers.RotatingFileHandler(
+                log_file, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8'
+            )
+        self.handlers = [file_handler]
+        if console:
+            self.handlers.append(logging.StreamHandler(sys.stderr))
+        formatter = JsonFormatter() if json_format else logging.Formatter(TEXT_FORMAT)
+        for handler in self.handlers:
+            handler.setFormatter(formatter)
+
+        self._queue = queue.SimpleQueue()
+        self.listener = logging.handlers.QueueListener(self._queue, *self.handlers, respect_handler_level=True)
+
+        # Replace any handlers installed before, so every record is written once
+        root = logging.getLogger()
+        for handler in root.handlers[:]:
+            root.removeHandler(handler)
+        root.addHandler(_QueueHandler(self._queue))
+        root.setLevel(level)
+
+        self.listener.start()
+        atexit.register(self.close)
+
+    def close(self):
+        """Write out queued records and stop the writer thread"""
+        if self.listener._thread is None:
+            return
+        self.listener.stop()
+        for handler in self.handlers:
+            handler.close()
@@ -0,0 +1,90 @@
+import json
+import queue
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+_FLUSH = object()
+_STOP = object()
+
+
+class BatchedLogWriter:
+    """Appends records to JSON Lines files from a background thread
+
+    write() only enqueues the record, so logging costs O(1) on the caller's
+    thread. Records are written in batches once batch_size records are
+    pending or flush_interval seconds have passed since the last flush.
+    """
+
+    def __init__(self, batch_size=100, flush_interval=1.0):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.written = 0
+        self.batches = 0
+        self._queue = queue.SimpleQueue()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+        self._thread.start()
+
+    def write(self, file_path, record):
+        """Queue a record to be appended to file_path"""
+        self._queue.put((file_path, record))
+
+    def flush(self):
+        """Write all queued records and wait until they are on disk"""
+        if self._closed:
+            return
+        done = threading.Event()
+        self._queue.put((_FLUSH, done))
+        done.wait()
+
+    def close(self):
+        """Flush pending records and stop the writer thread"""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put((_STOP, None))
+        self._thread.join()
+
+    def _run(self):
+        pending = {}
+        pending_count = 0
+        last_flush = time.monotonic()
+
+        while True:
+            timeout = max(0.0, last_flush + self.flush_interval - time.monotonic())
+            try:
+                file_path, record = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                file_path, record = None, None
+
+            if file_path is not None and file_path is not _FLUSH and file_path is not _STOP:
+                pending.setdefault(file_path, []).append(record)
+                pending_count += 1
+                due = time.monotonic() >= last_flush + self.flush_interval
+                if pending_count < self.batch_size and not due:
+                    continue
+
+            self._write_batch(pending)
+            pending = {}
+            pending_count = 0
+            last_flush = time.monotonic()
+
+            if file_path is _FLUSH:
+                record.set()
+            elif file_path is _STOP:
+                return
+
+    def _write_batch(self, pending):
+        for file_path, records in pending.items():
+            try:
+                lines = "".join(json.dumps(record) + "\n" for record in records)
+                with open(file_path, 'a') as f:
+                    f.write(lines)
+                self.written += len(records)
+            except Exception as e:
+                logger.error(f"Error writing {len(records)} records to {file_path}: {str(e)}")
+        if pending:
+            self.batches += 1
@@ -1,43 +1,342 @@
 import os
 import ssl
 import json
-import requests
 import logging
 import yt_dlp
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
+from telegram.error import BadRequest
 from telegram.ext import Application, CommandHandler, CallbackQueryHandler, ContextTypes, MessageHandler, filters
 import certifi
 from dotenv import load_dotenv
 from data_recorder import DataRecorder
+from scheduler import JobScheduler
+from file_id_cache import FileIdCache
+from single_flight import SingleFlight
+from search_cache import SearchCache
+from video_metadata import VideoMetadataStore
+from audio_cache import AudioCache
+from transcoder import TranscodePool, QueueFullError, transcode_to_mp3, transcode_stream_to_mp3, split_audio
+from upload_limits import UploadPlanner, TrackTooLargeError
+from prefetch import Prefetcher
+from rate_limiter import RateLimiter
+from streaming import StreamError, resolve_stream, read_stream
+from ydl_pool import YoutubeDLPool
+from http_session import create_session
+from job_queue import DurableJobQueue
+from log_pipeline import LogPipeline
+from metrics import Metrics
+from slow_requests import SlowRequestProfiler
+from contextlib import nullcontext
 from datetime import datetime
 import re
+import time
+import asyncio
+import functools
+import threading
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
 
 # Load environment variables
 load_dotenv()
 
-# Initialize data recorder
-data_recorder = DataRecorder()
-
-# Configure logging to both file and console
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('bot.log'),
-        logging.StreamHandler()  # This will output to console
-    ]
+# Download backend: 'local' downloads in the bot process, 'queue' hands
+# downloads to worker processes (worker.py) through a durable job queue
+DOWNLOAD_BACKEND = os.getenv('DOWNLOAD_BACKEND', 'local').lower()
+if DOWNLOAD_BACKEND not in ('local', 'queue'):
+    raise ValueError(f"Invalid DOWNLOAD_BACKEND: {DOWNLOAD_BACKEND}")
+
+# Set by worker.py, which imports this module for its download and delivery
+# code. Workers leave the analytics logs, statistics, file_id cache and
+# saved searches to the bot process, since it rewrites those files.
+DOWNLOAD_WORKER = os.getenv('DOWNLOAD_WORKER', 'false').lower() == 'true'
+
+# Transcode worker processes and how many transcodes may wait for a free
+# worker before new ones are turned away. The bot starts one per core, or
+# none with the queue backend, where it never transcodes. A download
+# worker defaults to one per download job (at most one per core), so
+# several workers on one host don't each start one per core.
+CPU_COUNT = os.cpu_count() or 1
+if DOWNLOAD_WORKER:
+    DEFAULT_TRANSCODE_WORKERS = min(int(os.getenv('DOWNLOAD_WORKERS', '4')), CPU_COUNT)
+else:
+    DEFAULT_TRANSCODE_WORKERS = CPU_COUNT
+TRANSCODE_WORKERS = int(os.getenv('TRANSCODE_WORKERS', '0')) or DEFAULT_TRANSCODE_WORKERS
+TRANSCODE_QUEUE_SIZE = int(os.getenv('TRANSCODE_QUEUE_SIZE', '100'))
+
+# Initialize transcode worker pool. Its workers are forked here, before
+# the log pipeline or anything else starts a thread.
+transcode_pool = TranscodePool(
+    max_workers=TRANSCODE_WORKERS,
+    max_queue=TRANSCODE_QUEUE_SIZE,
+    on_wait=lambda wait: metrics.observe('queue_wait_seconds', wait, pool='transcode')
+) if DOWNLOAD_BACKEND == 'local' or DOWNLOAD_WORKER else None
+
+# Logging: records are written to LOG_FILE and the console by a background
+# thread. LOG_FILE is rotated at LOG_MAX_MB, or on the LOG_ROTATE_WHEN
+# schedule (e.g. 'midnight') if set. LOG_FORMAT=json writes one JSON object
+# per line.
+LOG_FILE = os.getenv('LOG_FILE', 'bot.log')
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'text').lower()
+if LOG_FORMAT not in ('text', 'json'):
+    raise ValueError(f"Invalid LOG_FORMAT: {LOG_FORMAT}")
+LOG_MAX_MB = int(os.getenv('LOG_MAX_MB', '50'))
+LOG_ROTATE_WHEN = os.getenv('LOG_ROTATE_WHEN')
+LOG_BACKUP_COUNT = int(os.getenv('LOG_BACKUP_COUNT', '5'))
+LOG_CONSOLE = os.getenv('LOG_CONSOLE', 'true').lower() == 'true'
+
+# Configure logging before anything logs
+log_pipeline = LogPipeline(
+    LOG_FILE,
+    level=LOG_LEVEL,
+    json_format=LOG_FORMAT == 'json',
+    max_bytes=LOG_MAX_MB * 1024 * 1024,
+    backup_count=LOG_BACKUP_COUNT,
+    rotate_when=LOG_ROTATE_WHEN,
+    console=LOG_CONSOLE
 )
 logger = logging.getLogger(__name__)
 
+# Initialize data recorder; ANALYTICS_BACKEND=sqlite also keeps the logs in
+# an indexed SQLite database for time-range and per-user statistics
+data_recorder = None if DOWNLOAD_WORKER else DataRecorder(
+    backend=os.getenv('ANALYTICS_BACKEND', 'jsonl').lower()
+)
+
 # Get bot token from environment variable
 TOKEN = os.getenv('BOT_TOKEN')
 if not TOKEN:
     raise ValueError("No BOT_TOKEN found in environment variables")
 
+# Bot API server, e.g. a self-hosted telegram-bot-api instance
+BOT_API_BASE_URL = os.getenv('BOT_API_BASE_URL', 'https://api.telegram.org/bot')
+
+# Update delivery: 'polling' long-polls Telegram for updates, 'webhook'
+# serves an HTTP endpoint that Telegram posts updates to
+UPDATE_MODE = os.getenv('UPDATE_MODE', 'polling').lower()
+if UPDATE_MODE not in ('polling', 'webhook'):
+    raise ValueError(f"Invalid UPDATE_MODE: {UPDATE_MODE}")
+
+# Webhook settings: the public URL Telegram posts to, the local address the
+# bot listens on behind it, and the secret Telegram sends with each update
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')
+WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8443'))
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', 'telegram')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv('WEBHOOK_MAX_CONNECTIONS', '40'))
+if UPDATE_MODE == 'webhook' and not WEBHOOK_URL:
+    raise ValueError("WEBHOOK_URL is required when UPDATE_MODE is webhook")
+if WEBHOOK_SECRET and not re.fullmatch(r'[A-Za-z0-9_-]{1,256}', WEBHOOK_SECRET):
+    raise ValueError("WEBHOOK_SECRET may only contain letters, digits, _ and - (at most 256)")
+
+# Audio delivery mode: 'native' sends YouTube's own audio stream without
+# re-encoding, 'mp3' transcodes every track to MP3 with FFmpeg
+AUDIO_DELIVERY_MODE = os.getenv('AUDIO_DELIVERY_MODE', 'native').lower()
+if AUDIO_DELIVERY_MODE == 'mp3':
+    AUDIO_CODEC = 'mp3'
+    AUDIO_QUALITY = os.getenv('MP3_QUALITY', '192')
+    # The MP3 transcode runs afterwards on the transcode worker pool
+    STREAM_FORMAT = 'bestaudio/best'
+    DOWNLOAD_OPTIONS = {'format': STREAM_FORMAT}
+    # Long tracks are transcoded at a lower bitrate to fit the upload limit
+    NOMINAL_KBPS = int(AUDIO_QUALITY)
+    FALLBACK_KBPS = (128, 96, 64)
+elif AUDIO_DELIVERY_MODE == 'native':
+    AUDIO_CODEC = 'native'
+    AUDIO_QUALITY = 'best'
+    # Prefer M4A, which Telegram plays as-is. Other streams keep their codec
+    # and are only remuxed into a matching container, never re-encoded.
+    STREAM_FORMAT = 'bestaudio[ext=m4a]/bestaudio/best'
+    DOWNLOAD_OPTIONS = {
+        'format': STREAM_FORMAT,
+        'postprocessors': [{
+            'key': 'FFmpegExtractAudio',
+            'preferredcodec': 'best',
+        }],
+    }
+    # YouTube's M4A audio is about 128 kbps AAC; long tracks fall back to
+    # its lower-bitrate formats (Opus at 70 or 50 kbps, AAC at 48 kbps)
+    NOMINAL_KBPS = 130
+    FALLBACK_KBPS = (70, 50)
+else:
+    raise ValueError(f"Invalid AUDIO_DELIVERY_MODE: {AUDIO_DELIVERY_MODE}")
+AUDIO_PROFILE = f"{AUDIO_CODEC}-{AUDIO_QUALITY}"
+
+# CPU time spent producing downloaded tracks in the current delivery mode
+delivery_stats = {'tracks': 0, 'cpu_seconds': 0.0}
+
+# Delivery pipeline: 'file' downloads tracks into downloads/ before uploading,
+# 'stream' passes the audio through memory without writing it to disk and
+# falls back to the file pipeline when a track can't be streamed
+DELIVERY_PIPELINE = os.getenv('DELIVERY_PIPELINE', 'file').lower()
+if DELIVERY_PIPELINE not in ('file', 'stream'):
+    raise ValueError(f"Invalid DELIVERY_PIPELINE: {DELIVERY_PIPELINE}")
+
+# Largest track buffered in memory; Telegram rejects bot uploads over 50 MB
+STREAM_MAX_BYTES = int(os.getenv('STREAM_MAX_MB', '50')) * 1024 * 1024
+
+# Telegram rejects bot uploads over 50 MB (2000 MB through a self-hosted Bot
+# API server). Tracks that wouldn't fit get a lower bitrate or are split
+# into at most UPLOAD_MAX_PARTS parts; longer ones are turned away.
+UPLOAD_LIMIT_MB = int(os.getenv('UPLOAD_LIMIT_MB', '50'))
+UPLOAD_MAX_PARTS = int(os.getenv('UPLOAD_MAX_PARTS', '4'))
+
+# Initialize upload planning
+upload_planner = UploadPlanner(
+    UPLOAD_LIMIT_MB * 1024 * 1024,
+    NOMINAL_KBPS,
+    FALLBACK_KBPS,
+    max_parts=UPLOAD_MAX_PARTS
+)
+
+# Initialize Telegram file_id cache
+file_id_cache = None if DOWNLOAD_WORKER else FileIdCache()
+
+# Search result cache settings
+SEARCH_CACHE_SIZE = int(os.getenv('SEARCH_CACHE_SIZE', '1000'))
+SEARCH_CACHE_TTL = int(os.getenv('SEARCH_CACHE_TTL', '3600'))
+SEARCH_CACHE_STALE_TTL = int(os.getenv('SEARCH_CACHE_STALE_TTL', '86400'))
+SEARCH_CACHE_PERSIST = os.getenv('SEARCH_CACHE_PERSIST', 'true').lower() == 'true'
+
+# Initialize search result cache
+search_cache = SearchCache(
+    max_entries=SEARCH_CACHE_SIZE,
+    ttl=SEARCH_CACHE_TTL,
+    stale_ttl=SEARCH_CACHE_STALE_TTL,
+    cache_file=os.path.join('data', 'search_cache.json') if SEARCH_CACHE_PERSIST and not DOWNLOAD_WORKER else None
+)
+
+# Directory and disk budget for downloaded audio
+AUDIO_CACHE_DIR = os.getenv('AUDIO_CACHE_DIR', 'downloads')
+AUDIO_CACHE_MAX_MB = int(os.getenv('AUDIO_CACHE_MAX_MB', '2048'))
+
+# Initialize downloaded audio cache
+audio_cache = AudioCache(AUDIO_CACHE_DIR, max_bytes=AUDIO_CACHE_MAX_MB * 1024 * 1024)
+
+# Initialize shared video metadata store
+video_metadata = VideoMetadataStore()
+
+# Worker pool sizes for blocking yt-dlp jobs, one pool per job type
+SEARCH_WORKERS = int(os.getenv('SEARCH_WORKERS', '8'))
+METADATA_WORKERS = int(os.getenv('METADATA_WORKERS', '8'))
+DOWNLOAD_WORKERS = int(os.getenv('DOWNLOAD_WORKERS', '4'))
+
+# Maximum number of updates handled at the same time
+CONCURRENT_UPDATES = int(os.getenv('CONCURRENT_UPDATES', '256'))
+
+# Prometheus metrics endpoint; METRICS_PORT=0 disables it
+METRICS_PORT = int(os.getenv('METRICS_PORT', '0'))
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+
+# Requests slower than this many seconds get their stacks sampled into
+# SLOW_REQUEST_LOG; 0 disables the profiler
+SLOW_REQUEST_SECONDS = float(os.getenv('SLOW_REQUEST_SECONDS', '0'))
+SLOW_REQUEST_LOG = os.getenv('SLOW_REQUEST_LOG', os.path.join('data', 'slow_requests.log'))
+
+# Initialize metrics; gauges and cache counters are read when scraped
+metrics = Metrics()
+metrics.describe('requests_total', 'counter', "Updates handled, by handler")
+metrics.describe('request_seconds', 'histogram', "Time to handle an update, by handler")
+metrics.describe('stage_seconds', 'histogram', "Time spent in each stage of a search or download")
+metrics.describe('queue_wait_seconds', 'histogram', "Time jobs waited for a worker, by pool")
+metrics.describe('jobs_running', 'gauge', "Jobs running on a worker, by pool")
+metrics.describe('jobs_queued', 'gauge', "Jobs waiting for a worker, by pool")
+metrics.describe('downloads_in_flight', 'gauge', "Distinct tracks being fetched")
+metrics.describe('cache_hits_total', 'counter', "Cache lookups that found an entry, by cache")
+metrics.describe('cache_misses_total', 'counter', "Cache lookups that found nothing, by cache")
+metrics.describe('rate_limited_total', 'counter', "Actions rejected by the rate limiter, by action")
+
+slow_request_profiler = SlowRequestProfiler(
+    SLOW_REQUEST_SECONDS,
+    log_file=SLOW_REQUEST_LOG
+) if SLOW_REQUEST_SECONDS > 0 else None
+
+# Speculative downloads of likely-selected search results
+PREFETCH_ENABLED = os.getenv('PREFETCH_ENABLED', 'false').lower() == 'true'
+PREFETCH_MAX_JOBS = int(os.getenv('PREFETCH_MAX_JOBS', '2'))
+PREFETCH_CANDIDATES = int(os.getenv('PREFETCH_CANDIDATES', '1'))
+
+JOB_QUEUE_FILE = os.getenv('JOB_QUEUE_FILE', os.path.join('data', 'jobs.db'))
+JOB_LEASE_SECONDS = int(os.getenv('JOB_LEASE_SECONDS', '120'))
+JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', '3'))
+
+# Initialize the download job queue
+download_queue = DurableJobQueue(
+    JOB_QUEUE_FILE,
+    lease_seconds=JOB_LEASE_SECONDS,
+    max_attempts=JOB_MAX_ATTEMPTS
+) if DOWNLOAD_BACKEND == 'queue' else None
+
+# Per-user rate limits: sustained actions per minute (0 disables) and burst size
+SEARCH_RATE_LIMIT = int(os.getenv('SEARCH_RATE_LIMIT', '10'))
+SEARCH_BURST = int(os.getenv('SEARCH_BURST', '5'))
+DOWNLOAD_RATE_LIMIT = int(os.getenv('DOWNLOAD_RATE_LIMIT', '6'))
+DOWNLOAD_BURST = int(os.getenv('DOWNLOAD_BURST', '3'))
+
+# Initialize per-user rate limiters
+search_limiter = RateLimiter('search', SEARCH_RATE_LIMIT, SEARCH_BURST)
+download_limiter = RateLimiter('download', DOWNLOAD_RATE_LIMIT, DOWNLOAD_BURST)
+
+# Initialize job scheduler
+scheduler = JobScheduler({
+    'search': SEARCH_WORKERS,
+    'metadata': METADATA_WORKERS,
+    'download': DOWNLOAD_WORKERS
+}, on_wait=lambda pool, wait: metrics.observe('queue_wait_seconds', wait, pool=pool))
+
+# Pre-warmed YoutubeDL instances, one per worker of each job type
+ydl_pool = YoutubeDLPool({
+    'search': (SEARCH_WORKERS, {
+        'format': 'bestaudio/best',
+        'quiet': True,
+        'no_warnings': True,
+        'extract_flat': True,
+        'default_search': 'ytsearch',
+        'max_downloads': 5
+    }),
+    'metadata': (METADATA_WORKERS, {
+        'format': STREAM_FORMAT,
+        'quiet': True,
+        'no_warnings': True
+    }),
+    'download': (DOWNLOAD_WORKERS, DOWNLOAD_OPTIONS)
+})
+
 # Create SSL context
 ssl_context = ssl.create_default_context()
 ssl_context.load_verify_locations(cafile=certifi.where())
 
+# Shared keep-alive HTTP session for oEmbed lookups and direct stream downloads
+http_session = create_session(ssl_context)
+
+def timed(stage, func):
+    """Wrap a worker thread job to record its run time, without queue wait, as a stage"""
+    @functools.wraps(func)
+    def run(*args):
+        with metrics.timer('stage_seconds', stage=stage):
+            return func(*args)
+    return run
+
+def instrumented(handler):
+    """Count and time a handler's updates, and profile the slow ones"""
+    name = handler.__name__
+
+    @functools.wraps(handler)
+    async def wrapper(update, context):
+        metrics.inc('requests_total', handler=name)
+        profiling = (
+            slow_request_profiler.track(f"{name} (update {update.update_id})")
+            if slow_request_profiler else nullcontext()
+        )
+        with metrics.timer('request_seconds', handler=name), profiling:
+            return await handler(update, context)
+    return wrapper
+
+@instrumented
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Send welcome message"""
     welcome_text = (
@@ -52,6 +351,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
     await update.message.reply_text(welcome_text)
 
+@instrumented
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Send help message"""
     help_text = (
@@ -71,40 +371,51 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(help_text)
 
 def get_video_info(video_id):
-    """Get video information using YouTube's oEmbed API"""
+    """Get video information, using YouTube's oEmbed API if it is not already known"""
+    metadata = video_metadata.get(video_id)
+    if metadata and 'title' in metadata and 'artist' in metadata:
+        return {
+            'title': metadata['title'],
+            'author': metadata['artist']
+        }
+
     try:
         url = f"https://www.youtube.com/oembed?url=https://www.youtube.com/watch?v={video_id}&format=json"
-        response = requests.get(url)
+        response = http_session.get(url, timeout=10)
         if response.status_code == 200:
             data = response.json()
+            metadata = video_metadata.put(
+                video_id,
+                title=data.get('title'),
+                artist=data.get('author_name')
+            )
             return {
-                'title': data.get('title', 'Unknown Title'),
-                'author': data.get('author_name', 'Unknown Artist')
+                'title': metadata.get('title', 'Unknown Title'),
+                'author': metadata.get('artist', 'Unknown Artist')
             }
     except Exception as e:
         logger.error(f"Error getting video info: {str(e)}")
     return None
 
+def sanitize_query(query):
+    """Remove characters that are not allowed in search queries"""
+    sanitized_query = re.sub(r'[^\w\s-]', '', query)
+    if not sanitized_query:
+        raise ValueError("Invalid search query")
+    return sanitized_query
+
+def search_cache_key(query):
+    """Normalize a query so equivalent searches share a cache entry"""
+    return ' '.join(sanitize_query(query).lower().split())
+
 def search_youtube(query):
     """Search YouTube for videos"""
     try:
         # Sanitize query
-        sanitized_query = re.sub(r'[^\w\s-]', '', query)
-        if not sanitized_query:
-            raise ValueError("Invalid search query")
-
-        # Configure yt-dlp options for search
-        ydl_opts = {
-            'format': 'bestaudio/best',
-            'quiet': True,
-            'no_warnings': True,
-            'extract_flat': True,
-            'default_search': 'ytsearch',
-            'max_downloads': 5
-        }
+        sanitized_query = sanitize_query(query)
 
         results = []
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        with ydl_pool.lease('search') as ydl:
             # Search for videos
             search_results = ydl.extract_info(f"ytsearch5:{sanitized_query}", download=False)
             
@@ -140,6 +451,8 @@ def search_youtube(query):
                         'id': entry.get('id', ''),
                         'title': entry.get('title', 'Unknown Title'),
                         'artist': entry.get('uploader', 'Unknown Artist'),
+                        'duration': duration if isinstance(duration, (int, float)) else None,
+                        'views': view_count if isinstance(view_count, (int, float)) else None,
                         'duration_str': duration_str,
                         'view_str': view_str
                     })
@@ -150,6 +463,358 @@ def search_youtube(query):
         logger.error(f"Error in search_youtube: {str(e)}")
         raise
 
+def get_cpu_time():
+    """Get CPU time used by this thread and by finished child processes such as FFmpeg"""
+    cpu_time = time.thread_time()
+    if resource:
+        usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+        cpu_time += usage.ru_utime + usage.ru_stime
+    return cpu_time
+
+def download_audio(video_id, job_path, cancel_event=None, format_spec=None):
+    """Download a video's audio track to job_path
+
+    Returns the file path, the video info and the CPU seconds the download
+    took. Child process CPU time is process-wide, so the figure is only
+    approximate while other downloads run at the same time. Setting
+    cancel_event aborts the download and removes its files. format_spec
+    overrides the profile's format selection.
+    """
+    # Progress reports split the job into extraction, download and postprocessing
+    marks = {}
+
+    def check_cancelled(progress):
+        if cancel_event is not None and cancel_event.is_set():
+            raise yt_dlp.utils.DownloadCancelled()
+        if progress is not None:
+            marks.setdefault('downloading', time.monotonic())
+            if progress.get('status') == 'finished':
+                marks['finished'] = time.monotonic()
+
+    try:
+        started = time.monotonic()
+        cpu_start = get_cpu_time()
+        with ydl_pool.lease(
+            'download',
+            outtmpl=f'{job_path}.%(ext)s',
+            progress_hook=check_cancelled,
+            format_spec=format_spec
+        ) as ydl:
+            info = ydl.extract_info(f"https://www.youtube.com/watch?v={video_id}", download=True)
+        cpu_seconds = get_cpu_time() - cpu_start
+        check_cancelled(None)
+    except BaseException:
+        audio_cache.discard_temp(job_path)
+        raise
+
+    finished = time.monotonic()
+    downloading = marks.get('downloading', finished)
+    downloaded = marks.get('finished', downloading)
+    metrics.observe('stage_seconds', downloading - started, stage='extract')
+    metrics.observe('stage_seconds', downloaded - downloading, stage='download')
+    metrics.observe('stage_seconds', finished - downloaded, stage='postprocess')
+
+    # The final path reflects any postprocessing (transcode or remux)
+    audio_file = info['requested_downloads'][0]['filepath']
+    return audio_file, info, cpu_seconds
+
+def fallback_format(kbps):
+    """Get the format spec of the best audio at or below kbps in native mode"""
+    return f'bestaudio[ext=m4a][abr<={kbps}]/bestaudio[abr<={kbps}]/worstaudio'
+
+async def download_to_cache(video_id, on_queued=None, user_id=None, kbps=None):
+    """Download a track into the audio cache
+
+    Returns the pinned cache path and the video info. kbps selects a
+    fallback bitrate for tracks that wouldn't fit the upload limit.
+    """
+    # Every job gets its own working path so concurrent jobs never collide
+    job_path = audio_cache.new_temp_path(video_id)
+    cancel_event = threading.Event()
+    format_spec = fallback_format(kbps) if kbps and AUDIO_DELIVERY_MODE == 'native' else None
+    quality = kbps or AUDIO_QUALITY
+    try:
+        temp_file, info, cpu_seconds = await scheduler.run(
+            'download', download_audio, video_id, job_path, cancel_event, format_spec, user_id=user_id
+        )
+        if AUDIO_DELIVERY_MODE == 'mp3':
+            with metrics.timer('stage_seconds', stage='transcode'):
+                mp3_file, transcode_cpu = await transcode_pool.run(
+                    transcode_to_mp3,
+                    temp_file,
+                    f'{job_path}.{quality}k.mp3',
+                    quality,
+                    on_queued=on_queued,
+                    user_id=user_id
+                )
+            temp_file = mp3_file
+            cpu_seconds += transcode_cpu
+        audio_path = audio_cache.publish(temp_file, video_id, AUDIO_PROFILE)
+    except asyncio.CancelledError:
+        # Stop a download that is still running on a worker thread
+        cancel_event.set()
+        raise
+    finally:
+        audio_cache.discard_temp(job_path)
+    record_delivery(video_id, os.path.splitext(audio_path)[1][1:], cpu_seconds)
+    return audio_path, info
+
+async def stream_to_memory(video_id, on_queued=None, user_id=None, kbps=None):
+    """Stream a track into memory without writing it to disk
+
+    Returns the audio bytes, their file extension and the video info.
+    Raises StreamError if the track has to go through the file-based path.
+    """
+    if kbps and AUDIO_DELIVERY_MODE == 'native':
+        raise StreamError(f"{video_id} needs a lower-bitrate format")
+    info = await scheduler.run('metadata', timed('extract', resolve_stream), ydl_pool, video_id, user_id=user_id)
+
+    if AUDIO_DELIVERY_MODE == 'mp3':
+        # FFmpeg downloads and transcodes the stream in one go
+        with metrics.timer('stage_seconds', stage='transcode'):
+            data, cpu_seconds = await transcode_pool.run(
+                transcode_stream_to_mp3,
+                info['url'],
+                info.get('http_headers') or {},
+                kbps or AUDIO_QUALITY,
+                STREAM_MAX_BYTES,
+                on_queued=on_queued,
+                user_id=user_id
+            )
+        ext = 'mp3'
+    else:
+        ext = info.get('ext')
+        if ext not in ('m4a', 'mp3'):
+            raise StreamError(f"{ext} stream of {video_id} needs remuxing")
+        cancel_event = threading.Event()
+        try:
+            data = await scheduler.run(
+                'download', timed('download', read_stream), http_session, info, STREAM_MAX_BYTES, cancel_event,
+                user_id=user_id
+            )
+        except asyncio.CancelledError:
+            cancel_event.set()
+            raise
+        cpu_seconds = 0.0
+
+    record_delivery(video_id, ext, cpu_seconds, streamed=True)
+    return data, ext, info
+
+def record_delivery(video_id, ext, cpu_seconds, streamed=False):
+    """Account the CPU time spent producing a track"""
+    delivery_stats['tracks'] += 1
+    delivery_stats['cpu_seconds'] += cpu_seconds
+    logger.info(
+        f"{'Streamed' if streamed else 'Downloaded'} {video_id} as {ext} "
+        f"({AUDIO_DELIVERY_MODE} mode) using {cpu_seconds:.2f}s CPU"
+    )
+
+async def fetch_audio(video_id, on_queued=None, user_id=None):
+    """Get a video's audio, along with its title and artist
+
+    The result holds either a 'path' in the audio cache, pinned until
+    release_audio is called, or in-memory 'data' with its 'ext' when the
+    streaming pipeline is enabled. on_queued(position) is awaited if the
+    transcode has to wait for a worker. Jobs queue fairly on behalf of user_id.
+    Tracks over the upload limit are split, and the result then also holds
+    the 'parts' to send instead. Raises TrackTooLargeError for tracks that
+    can't be delivered.
+    """
+    # Search results usually provided the metadata already; otherwise it
+    # comes for free with the download instead of a separate extraction
+    metadata = video_metadata.get(video_id)
+    info = None
+    
+    # Fit the upload limit before downloading anything
+    plan = upload_planner.plan((metadata or {}).get('duration'))
+    if plan['kbps'] or plan['parts'] > 1:
+        logger.info(
+            f"Track {video_id} is about {plan['size'] / 1024 / 1024:.0f} MB: "
+            + (f"using {plan['kbps']} kbps" if plan['kbps'] else f"sending {plan['parts']} parts")
+        )
+    
+    result = {}
+    audio_path = audio_cache.lookup(video_id, AUDIO_PROFILE)
+    if audio_path is not None:
+        result['path'] = audio_path
+    else:
+        if DELIVERY_PIPELINE == 'stream' and plan['parts'] == 1:
+            try:
+                data, ext, info = await stream_to_memory(video_id, on_queued, user_id, plan['kbps'])
+                result = {'data': data, 'ext': ext}
+            except QueueFullError:
+                raise
+            except Exception as e:
+                logger.warning(f"Streaming {video_id} failed, falling back to file download: {str(e)}")
+        if not result:
+            audio_path, info = await download_to_cache(video_id, on_queued, user_id, plan['kbps'])
+            result['path'] = audio_path
+    
+    # The estimate can be off, or the duration unknown; check the real size
+    if 'path' in result:
+        size = os.path.getsize(result['path'])
+        if size > upload_planner.target_bytes:
+            duration = (info or {}).get('duration') or (metadata or {}).get('duration')
+            try:
+                result['parts'], result['parts_path'] = await split_track(
+                    video_id, result['path'], size, duration, user_id
+                )
+            except BaseException:
+                release_audio(result)
+                raise
+    
+    if not metadata or 'title' not in metadata or 'artist' not in metadata:
+        if info:
+            metadata = video_metadata.put_info(info)
+        else:
+            info = await scheduler.run('metadata', timed('metadata', get_video_info), video_id, user_id=user_id)
+            metadata = {'title': info['title'], 'artist': info['author']} if info else {}
+    
+    result['title'] = metadata.get('title', 'Unknown Title')
+    result['artist'] = metadata.get('artist', 'Unknown Artist')
+    return result
+
+async def split_track(video_id, path, size, duration, user_id=None):
+    """Split a downloaded track that is over the upload limit
+
+    Returns the part files and the working path they were written under.
+    An unknown duration is read from the file.
+    """
+    parts = upload_planner.parts_for(size, duration)
+    parts_path = audio_cache.new_temp_path(video_id)
+    try:
+        with metrics.timer('stage_seconds', stage='split'):
+            files, _ = await transcode_pool.run(split_audio, path, parts_path, parts, duration, user_id=user_id)
+    except BaseException:
+        audio_cache.discard_temp(parts_path)
+        raise
+    logger.info(f"Split {video_id} ({size / 1024 / 1024:.0f} MB) into {len(files)} parts")
+    return files, parts_path
+
+def release_audio(result):
+    """Let the audio cache evict a file once no request is using it anymore"""
+    if 'path' in result:
+        audio_cache.release(result['path'])
+    if 'parts_path' in result:
+        audio_cache.discard_temp(result['parts_path'])
+
+async def send_audio(bot, chat_id, result):
+    """Upload a fetched track, from memory or from the audio cache
+
+    Returns the sent message, or None if the track was sent in parts.
+    """
+    title = result['title']
+    artist = result['artist']
+    with metrics.timer('stage_seconds', stage='upload'):
+        if 'parts' in result:
+            count = len(result['parts'])
+            for number, part in enumerate(result['parts'], 1):
+                with open(part, 'rb') as audio:
+                    await bot.send_audio(
+                        chat_id,
+                        audio,
+                        title=f"{title} ({number}/{count})",
+                        performer=artist,
+                        caption=f"🎵 {title} ({number}/{count})\n👤 {artist}"
+                    )
+            return None
+        if 'data' in result:
+            return await bot.send_audio(
+                chat_id,
+                result['data'],
+                filename=f"{title}.{result['ext']}",
+                title=title,
+                performer=artist,
+                caption=f"🎵 {title}\n👤 {artist}"
+            )
+        with open(result['path'], 'rb') as audio:
+            return await bot.send_audio(
+                chat_id,
+                audio,
+                title=title,
+                performer=artist,
+                caption=f"🎵 {title}\n👤 {artist}"
+            )
+
+# Concurrent requests for the same video share a single download
+download_flights = SingleFlight(on_release=release_audio)
+
+def is_audio_cached(video_id):
+    """Check whether a track can be sent without downloading it"""
+    return (
+        file_id_cache.contains(video_id, AUDIO_CODEC, AUDIO_QUALITY)
+        or audio_cache.contains(video_id, AUDIO_PROFILE)
+    )
+
+# Initialize speculative prefetching of search results. Prefetches need
+# the audio cache to keep their result until the click, so the stream
+# pipeline, which keeps nothing, goes without.
+if PREFETCH_ENABLED and (DOWNLOAD_BACKEND != 'local' or DELIVERY_PIPELINE != 'file'):
+    logger.warning("Prefetching needs the local download backend and the file pipeline; disabled")
+prefetcher = Prefetcher(
+    download_flights,
+    fetch_audio,
+    is_audio_cached,
+    max_jobs=PREFETCH_MAX_JOBS,
+    candidates=PREFETCH_CANDIDATES,
+    choices_file=os.path.join('data', 'prefetch_choices.json')
+) if PREFETCH_ENABLED and DOWNLOAD_BACKEND == 'local' and DELIVERY_PIPELINE == 'file' else None
+
+def collect_metrics():
+    """Read gauges and cache counters from the components that keep them"""
+    pools = {name: pool.get_stats() for name, pool in scheduler.pools.items()}
+    if transcode_pool:
+        pools['transcode'] = transcode_pool.get_stats()
+    for name, stats in pools.items():
+        yield 'jobs_running', {'pool': name}, stats['running']
+        yield 'jobs_queued', {'pool': name}, stats['queue_depth']
+    if download_queue:
+        yield 'jobs_queued', {'pool': 'workers'}, download_queue.get_stats()['queued']
+    yield 'downloads_in_flight', {}, download_flights.get_stats()['in_flight']
+    for name, cache in (
+        ('file_id', file_id_cache),
+        ('audio', audio_cache),
+        ('search', search_cache),
+        ('metadata', video_metadata)
+    ):
+        if cache is None:
+            continue
+        stats = cache.get_stats()
+        yield 'cache_hits_total', {'cache': name}, stats['hits'] + stats.get('stale_hits', 0)
+        yield 'cache_misses_total', {'cache': name}, stats['misses']
+    for limiter in (search_limiter, download_limiter):
+        yield 'rate_limited_total', {'action': limiter.name}, limiter.get_stats()['rejected']
+
+metrics.add_collector(collect_metrics)
+
+async def send_cached_audio(message, video_id):
+    """Resend a previously uploaded track by its Telegram file_id
+
+    Returns the (title, artist) of the sent track, or None if the track
+    is not cached or Telegram rejected the cached file_id.
+    """
+    cached = file_id_cache.get(video_id, AUDIO_CODEC, AUDIO_QUALITY)
+    if not cached:
+        return None
+
+    title = cached.get('title', 'Unknown Title')
+    artist = cached.get('artist', 'Unknown Artist')
+    try:
+        with metrics.timer('stage_seconds', stage='cached_send'):
+            await message.reply_audio(
+                cached['file_id'],
+                title=title,
+                performer=artist,
+                caption=f"🎵 {title}\n👤 {artist}"
+            )
+    except BadRequest as e:
+        logger.warning(f"Cached file_id for video {video_id} rejected: {str(e)}")
+        file_id_cache.invalidate(video_id, AUDIO_CODEC, AUDIO_QUALITY)
+        return None
+
+    return title, artist
+
+@instrumented
 async def search_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle the /search command"""
     if not context.args:
@@ -162,12 +827,41 @@ async def search_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = ' '.join(context.args)
     user_id = update.effective_user.id
     
+    # Keep one user's burst of searches from crowding out everyone else
+    retry_after = search_limiter.check(user_id)
+    if retry_after:
+        error_msg = f"Search rate limit exceeded, retry in {retry_after:.0f}s"
+        logger.warning(f"User {user_id}: {error_msg}")
+        data_recorder.log_error(
+            user_id,
+            "rate_limited",
+            error_msg,
+            {"action": "search", "query": query}
+        )
+        await update.message.reply_text(
+            f"⏳ You're searching too fast. Please try again in {int(retry_after) + 1} seconds."
+        )
+        return
+    
     try:
         # Log the search attempt
         logger.info(f"User {user_id} searching for: {query}")
         
-        # Perform the search
-        results = search_youtube(query)
+        # Perform the search, serving repeated queries from the cache
+        results = await search_cache.get(
+            search_cache_key(query),
+            lambda: scheduler.run('search', timed('search', search_youtube), query, user_id=user_id)
+        )
+        
+        # Share result metadata with the download path
+        for result in results:
+            video_metadata.put(
+                result['id'],
+                title=result['title'],
+                artist=result['artist'],
+                duration=result.get('duration'),
+                views=result.get('views')
+            )
         
         if not results:
             error_msg = f"No results found for query: {query}"
@@ -205,11 +899,23 @@ async def search_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             else:
                 view_str = "0"
 
+            # Flag tracks that won't be sent as a single full-quality file
+            try:
+                plan = upload_planner.plan(result.get('duration'))
+                if plan['parts'] > 1:
+                    size_note = f" | 📦 {plan['parts']} parts"
+                elif plan['kbps']:
+                    size_note = f" | 🔉 {plan['kbps']} kbps"
+                else:
+                    size_note = ""
+            except TrackTooLargeError:
+                size_note = " | 🚫 too long"
+
             # Create button text with more characters and better formatting
             button_text = (
                 f"🎵 {result['title'][:50]}\n"  # Show up to 50 characters of title
                 f"👤 {result['artist'][:30]}\n"  # Show up to 30 characters of artist
-                f"⏱ {result['duration_str']} | {view_str} views"  # Always show duration, concise views
+                f"⏱ {result['duration_str']} | {view_str} views{size_note}"  # Always show duration, concise views
             )
             
             # Add ellipsis if title or artist is truncated
@@ -224,10 +930,20 @@ async def search_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             keyboard.append([InlineKeyboardButton(button_text, callback_data=callback_data)])
 
         reply_markup = InlineKeyboardMarkup(keyboard)
-        await update.message.reply_text(
-            "Select a song to download:",
-            reply_markup=reply_markup
-        )
+        with metrics.timer('stage_seconds', stage='reply'):
+            results_msg = await update.message.reply_text(
+                "Select a song to download:",
+                reply_markup=reply_markup
+            )
+        
+        # Start downloading the likeliest picks while the user chooses
+        if prefetcher:
+            prefetcher.on_results(
+                results_msg.chat_id,
+                results_msg.message_id,
+                search_cache_key(query),
+                results
+            )
         
         # Log successful search
         data_recorder.log_search(
@@ -262,6 +978,7 @@ async def search_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             "❌ An error occurred while searching. Please try again in a few moments."
         )
 
+@instrumented
 async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle button callbacks"""
     query = update.callback_query
@@ -283,53 +1000,116 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
             )
             await query.edit_message_text("❌ Invalid video ID. Please try searching again.")
             return
+        
+        # Turn away tracks too long to upload before anything is downloaded.
+        # The results stay up so the user can pick another one.
+        metadata = video_metadata.get(video_id)
+        try:
+            upload_planner.plan((metadata or {}).get('duration'))
+        except TrackTooLargeError as e:
+            logger.warning(f"Rejected download of video {video_id}: {str(e)}")
+            data_recorder.log_error(
+                update.effective_user.id,
+                "track_too_long",
+                str(e),
+                {"video_id": video_id}
+            )
+            await query.message.reply_text(
+                f"🚫 This track is too long to send on Telegram "
+                f"(up to {upload_planner.max_duration() / 60:.0f} minutes). Please pick a shorter one."
+            )
+            return
+        
+        # Limit new downloads per user; previously uploaded tracks are
+        # resent without a download and don't count. The results stay
+        # up so the user can pick again later.
+        if not file_id_cache.contains(video_id, AUDIO_CODEC, AUDIO_QUALITY):
+            retry_after = download_limiter.check(update.effective_user.id)
+            if retry_after:
+                error_msg = f"Download rate limit exceeded, retry in {retry_after:.0f}s"
+                logger.warning(f"User {update.effective_user.id}: {error_msg}")
+                data_recorder.log_error(
+                    update.effective_user.id,
+                    "rate_limited",
+                    error_msg,
+                    {"action": "download", "video_id": video_id}
+                )
+                await query.message.reply_text(
+                    f"⏳ You're downloading too fast. Please try again in {int(retry_after) + 1} seconds."
+                )
+                return
+            
+        # Record the choice and cancel prefetches of the other results
+        prefetched = None
+        if prefetcher:
+            prefetched = prefetcher.on_selected(query.message.chat_id, query.message.message_id, video_id)
             
         try:
             # Delete the selection message
             await query.message.delete()
             
-            # Send temporary downloading message
-            downloading_msg = await query.message.reply_text("⏳ Downloading...")
+            # Reuse an earlier upload of this track if there is one
+            cached = await send_cached_audio(query.message, video_id)
+            if cached:
+                title, artist = cached
+                data_recorder.log_download(
+                    update.effective_user.id,
+                    video_id,
+                    title,
+                    artist
+                )
+                return
             
-            # Get video info
-            ydl_opts = {
-                'format': 'bestaudio/best',
-                'quiet': True,
-                'no_warnings': True,
-                'extract_flat': True
-            }
+            # Hand the download to the worker processes, which deliver the track
+            if download_queue:
+                queued_msg = await query.message.reply_text("⏳ Queued for download...")
+                await asyncio.to_thread(
+                    download_queue.enqueue,
+                    video_id,
+                    query.message.chat_id,
+                    queued_msg.message_id,
+                    update.effective_user.id
+                )
+                return
             
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(f"https://www.youtube.com/watch?v={video_id}", download=False)
-                title = info.get('title', 'Unknown Title')
-                artist = info.get('uploader', 'Unknown Artist')
+            # Send temporary downloading message
+            downloading_msg = await query.message.reply_text("⏳ Downloading...")
             
-            # Download the audio
-            ydl_opts = {
-                'format': 'bestaudio/best',
-                'postprocessors': [{
-                    'key': 'FFmpegExtractAudio',
-                    'preferredcodec': 'mp3',
-                    'preferredquality': '192',
-                }],
-                'outtmpl': f'downloads/{video_id}.%(ext)s',
-            }
+            async def show_queue_position(position):
+                try:
+                    await downloading_msg.edit_text(f"⏳ Queued, position {position}...")
+                except Exception as e:
+                    logger.warning(f"Could not update queue position: {str(e)}")
             
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                ydl.download([f"https://www.youtube.com/watch?v={video_id}"])
+            if prefetcher:
+                prefetcher.on_download(prefetched)
             
-            # Send the audio file
-            audio_path = f'downloads/{video_id}.mp3'
-            with open(audio_path, 'rb') as audio:
-                await query.message.reply_audio(
-                    audio,
-                    title=title,
-                    performer=artist,
-                    caption=f"🎵 {title}\n👤 {artist}"
+            # Get video info and download the audio, sharing the work with
+            # any other request for the same video that is already in flight
+            async with download_flights.acquire(
+                video_id,
+                lambda: fetch_audio(
+                    video_id,
+                    on_queued=show_queue_position,
+                    user_id=update.effective_user.id
                 )
+            ) as result:
+                title = result['title']
+                artist = result['artist']
+                
+                # Send the audio file
+                sent = await send_audio(context.bot, query.message.chat_id, result)
             
-            # Clean up
-            os.remove(audio_path)
+            # Remember the uploaded file so repeat requests skip the download
+            if sent and sent.audio:
+                file_id_cache.set(
+                    video_id,
+                    AUDIO_CODEC,
+                    AUDIO_QUALITY,
+                    sent.audio.file_id,
+                    title,
+                    artist
+                )
             
             # Delete the downloading message
             await downloading_msg.delete()
@@ -342,6 +1122,34 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 artist
             )
             
+        except QueueFullError as e:
+            logger.warning(f"Rejected download of video {video_id}: {str(e)}")
+            data_recorder.log_error(
+                update.effective_user.id,
+                "transcode_queue_full",
+                str(e),
+                {"video_id": video_id}
+            )
+            try:
+                await downloading_msg.delete()
+            except:
+                pass
+            await query.message.reply_text("⏳ The bot is very busy right now. Please try again in a minute.")
+            
+        except TrackTooLargeError as e:
+            logger.warning(f"Rejected download of video {video_id}: {str(e)}")
+            data_recorder.log_error(
+                update.effective_user.id,
+                "track_too_long",
+                str(e),
+                {"video_id": video_id}
+            )
+            try:
+                await downloading_msg.delete()
+            except:
+                pass
+            await query.message.reply_text("🚫 This track is too long to send on Telegram.")
+            
         except Exception as e:
             error_msg = f"Error downloading video {video_id}: {str(e)}"
             logger.error(error_msg)
@@ -358,9 +1166,99 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 pass
             await query.message.reply_text("❌ An error occurred while downloading. Please try again later.")
 
+async def collect_download_results():
+    """Record downloads finished by worker processes in the file_id cache and logs
+
+    Queue calls run on a thread, since they wait while a worker holds the
+    database's write lock.
+    """
+    while True:
+        try:
+            for job in await asyncio.to_thread(download_queue.collect):
+                if job['status'] == 'done':
+                    if job['file_id']:
+                        file_id_cache.set(
+                            job['video_id'],
+                            AUDIO_CODEC,
+                            AUDIO_QUALITY,
+                            job['file_id'],
+                            job['title'],
+                            job['artist']
+                        )
+                    data_recorder.log_download(job['user_id'], job['video_id'], job['title'], job['artist'])
+                else:
+                    data_recorder.log_error(
+                        job['user_id'],
+                        "download_error",
+                        job['error'],
+                        {"video_id": job['video_id'], "attempts": job['attempts']}
+                    )
+            await asyncio.to_thread(download_queue.purge, older_than=86400)
+        except Exception as e:
+            logger.error(f"Error collecting download results: {str(e)}")
+        await asyncio.sleep(2)
+
+async def post_init(application):
+    """Start background tasks once the bot is initialized"""
+    if download_queue:
+        application.bot_data['collector'] = asyncio.create_task(collect_download_results())
+
+async def post_stop(application):
+    """Stop background tasks after the last update was handled"""
+    collector = application.bot_data.pop('collector', None)
+    if collector:
+        collector.cancel()
+
+# Length of each /stats time window in seconds
+STATS_WINDOWS = {'hour': 3600, 'day': 86400, 'week': 7 * 86400}
+
+# Most recent hours and error types per hour listed in /stats
+STATS_HOURLY_LINES = 12
+STATS_HOURLY_ERROR_TYPES = 2
+
+# Longest query or artist name shown in /stats
+STATS_TEXT_LENGTH = 60
+
+# Telegram rejects messages over 4096 characters, some of which (e.g.
+# emoji) it counts twice
+MAX_MESSAGE_LENGTH = 4000
+
+def shorten(text, length=STATS_TEXT_LENGTH):
+    """Cut text to at most length characters"""
+    return text if len(text) <= length else text[:length - 1] + "…"
+
+def split_message(text, limit=MAX_MESSAGE_LENGTH):
+    """Split text into messages Telegram accepts, at line breaks where possible"""
+    chunks = [""]
+    for line in text.splitlines(keepends=True):
+        while line:
+            if len(chunks[-1]) + len(line) > limit and chunks[-1]:
+                chunks.append("")
+                continue
+            chunks[-1] += line[:limit]
+            line = line[limit:]
+    return chunks
+
+@instrumented
 async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle the /stats command to show bot statistics"""
-    stats = data_recorder.get_stats()
+    # Optional time window, e.g. /stats day, and 'me' for the user's own activity
+    window = None
+    user_id = None
+    for arg in (arg.lower() for arg in context.args or []):
+        if arg in ('hour', 'day', 'week'):
+            window = arg
+        elif arg == 'me':
+            user_id = update.effective_user.id
+        else:
+            await update.message.reply_text(
+                "Usage: /stats [hour|day|week] [me]\n"
+                "Example: /stats day me"
+            )
+            return
+    period = f" (last {window})" if window else ""
+    
+    stats = data_recorder.get_stats(window=window)
     if stats:
         message = (
             "📊 Bot Statistics:\n\n"
@@ -372,50 +1270,214 @@ async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             )
         )
         
+        # Add activity in the time window from the analytics database
+        since = time.time() - STATS_WINDOWS[window] if window else None
+        activity = await asyncio.to_thread(
+            data_recorder.query_stats, since, user_id, hours=STATS_HOURLY_LINES
+        )
+        if activity:
+            totals = activity['totals']
+            requests_made = totals['searches'] + totals['downloads']
+            message += (
+                f"\n📈 Activity{period}:\n"
+                f"Searches: {totals['searches']}, Downloads: {totals['downloads']}, "
+                f"Errors: {totals['errors']}"
+                f" ({totals['errors'] / requests_made if requests_made else 0:.1%} of requests)\n"
+                f"Active Users: {activity['active_users']}\n"
+            )
+            if activity['errors_by_type']:
+                message += "Errors by type: " + ", ".join(
+                    f"{shorten(error_type, 30)} {count}" for error_type, count in activity['errors_by_type']
+                ) + "\n"
+            if activity['user']:
+                mine = activity['user']
+                message += (
+                    f"You: {mine['searches']} searches, {mine['downloads']} downloads, "
+                    f"{mine['errors']} errors\n"
+                )
+            # Add the latest hours of the window, with each hour's most frequent error types
+            if activity['hourly']:
+                errors_by_hour = {}
+                for hour, error_type, count in activity['hourly_errors']:
+                    errors_by_hour.setdefault(hour, []).append((count, error_type))
+                message += "\n🕐 By hour:\n"
+                for hour, searches, downloads, errors in activity['hourly'][-STATS_HOURLY_LINES:]:
+                    requests_made = searches + downloads
+                    message += (
+                        f"- {datetime.fromtimestamp(hour).strftime('%m-%d %H:00')}: "
+                        f"{searches} searches, {downloads} downloads, {errors} errors"
+                        f" ({errors / requests_made if requests_made else 0:.1%})"
+                    )
+                    if hour in errors_by_hour:
+                        top_errors = sorted(errors_by_hour[hour], reverse=True)[:STATS_HOURLY_ERROR_TYPES]
+                        message += " - " + ", ".join(
+                            f"{shorten(error_type, 30)} {count}" for count, error_type in top_errors
+                        )
+                    message += "\n"
+        
         # Add top 5 popular searches
         if stats['popular_searches']:
-            message += "\n🔍 Top 5 Popular Searches:\n"
-            sorted_searches = sorted(
-                stats['popular_searches'].items(),
-                key=lambda x: x[1],
-                reverse=True
-            )[:5]
-            for search, count in sorted_searches:
-                message += f"- {search}: {count} times\n"
+            message += f"\n🔍 Top 5 Popular Searches{period}:\n"
+            for search, count in stats['popular_searches']:
+                message += f"- {shorten(search)}: {count} times\n"
         
         # Add top 5 popular artists
         if stats['popular_artists']:
-            message += "\n👤 Top 5 Popular Artists:\n"
-            sorted_artists = sorted(
-                stats['popular_artists'].items(),
-                key=lambda x: x[1],
-                reverse=True
-            )[:5]
-            for artist, count in sorted_artists:
-                message += f"- {artist}: {count} times\n"
+            message += f"\n👤 Top 5 Popular Artists{period}:\n"
+            for artist, count in stats['popular_artists']:
+                message += f"- {shorten(artist)}: {count} times\n"
+        
+        # Add file_id cache status
+        cache_stats = file_id_cache.get_stats()
+        message += (
+            f"\n📦 Cached Tracks: {cache_stats['entries']} "
+            f"(hit rate {cache_stats['hit_rate']:.0%})\n"
+        )
+        
+        # Add audio cache status
+        audio_stats = audio_cache.get_stats()
+        message += (
+            f"💾 Audio Cache: {audio_stats['bytes'] / 1024 ** 2:.0f}/"
+            f"{audio_stats['max_bytes'] / 1024 ** 2:.0f} MB "
+            f"(hit rate {audio_stats['hit_rate']:.0%})\n"
+        )
+        
+        # Add search cache status
+        search_stats = search_cache.get_stats()
+        message += (
+            f"🔎 Cached Searches: {search_stats['entries']} "
+            f"(hit rate {search_stats['hit_rate']:.0%})\n"
+        )
+        
+        # Add download deduplication status
+        flight_stats = download_flights.get_stats()
+        message += f"🔗 Coalesced Downloads: {flight_stats['coalesced']}\n"
+        
+        # Add delivery mode CPU cost
+        if delivery_stats['tracks']:
+            message += (
+                f"🎛 Delivery: {AUDIO_DELIVERY_MODE}, "
+                f"{delivery_stats['cpu_seconds'] / delivery_stats['tracks']:.2f}s CPU per track\n"
+            )
+        
+        # Add prefetch savings
+        if prefetcher:
+            prefetch_stats = prefetcher.get_stats()
+            message += (
+                f"⚡ Prefetch: {prefetch_stats['used']}/{prefetch_stats['started']} used, "
+                f"avg {prefetch_stats['avg_saved']:.1f}s saved per click\n"
+            )
+        
+        # Add rate limit rejections
+        search_limits = search_limiter.get_stats()
+        download_limits = download_limiter.get_stats()
+        if search_limits['rejected'] or download_limits['rejected']:
+            message += (
+                f"🚦 Rate Limited: {search_limits['rejected']} searches, "
+                f"{download_limits['rejected']} downloads\n"
+            )
+        
+        # Add job queue status
+        message += "\n⚙️ Job Queues:\n"
+        if download_queue:
+            queue_stats = await asyncio.to_thread(download_queue.get_stats)
+            message += (
+                f"- workers: {queue_stats['queued']} queued, "
+                f"{queue_stats['leased']} in progress\n"
+            )
+        for job_type, pool_stats in scheduler.get_stats().items():
+            message += (
+                f"- {job_type}: {pool_stats['running']}/{pool_stats['max_workers']} running, "
+                f"{pool_stats['queue_depth']} queued from {pool_stats['users_waiting']} users, "
+                f"avg wait {pool_stats['avg_wait']:.2f}s\n"
+            )
+        if transcode_pool:
+            transcode_stats = transcode_pool.get_stats()
+            message += (
+                f"- transcode: {transcode_stats['running']}/{transcode_stats['max_workers']} running, "
+                f"{transcode_stats['queue_depth']} queued from {transcode_stats['users_waiting']} users, "
+                f"{transcode_stats['avg_utilization']:.0%} utilization\n"
+            )
+            if transcode_stats['worker_utilization']:
+                message += "  workers: " + ", ".join(
+                    f"{utilization:.0%}" for utilization in transcode_stats['worker_utilization'].values()
+                ) + "\n"
         
-        await update.message.reply_text(message)
+        try:
+            for chunk in split_message(message):
+                await update.message.reply_text(chunk)
+        except Exception as e:
+            logger.error(f"Error sending stats: {str(e)}")
     else:
         await update.message.reply_text("❌ Unable to retrieve statistics at this time.")
 
-def main():
-    """Start the bot"""
-    # Create the Application
-    application = Application.builder().token(TOKEN).build()
-    
-    # Add handlers
+def add_handlers(application):
+    """Register the bot's command and button handlers"""
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("help", help_command))
     application.add_handler(CommandHandler("search", search_command))
     application.add_handler(CommandHandler("stats", stats_command))
     application.add_handler(CallbackQueryHandler(button_callback))
+
+def shutdown():
+    """Stop the worker pools and write out pending data"""
+    scheduler.shutdown()
+    if transcode_pool:
+        transcode_pool.shutdown()
+    ydl_pool.close()
+    if download_queue:
+        download_queue.close()
+    search_cache.save()
+    if prefetcher:
+        prefetcher.save()
+    if data_recorder:
+        data_recorder.close()
+    metrics.close()
+    if slow_request_profiler:
+        slow_request_profiler.close()
+    log_pipeline.close()
+
+def main():
+    """Start the bot"""
+    # Create the Application
+    application = (
+        Application.builder()
+        .token(TOKEN)
+        .base_url(BOT_API_BASE_URL)
+        .concurrent_updates(CONCURRENT_UPDATES)
+        .post_init(post_init)
+        .post_stop(post_stop)
+        .build()
+    )
+    
+    # Add handlers
+    add_handlers(application)
     
     # Create downloads directory if it doesn't exist
     os.makedirs('downloads', exist_ok=True)
     
-    # Start the bot
-    print("🎵 Music Search Bot is running...")
-    application.run_polling()
+    if METRICS_PORT:
+        metrics.serve(METRICS_HOST, METRICS_PORT)
+    
+    # Start the bot. On shutdown the webhook server stops accepting updates
+    # first, then updates already received are handled before exiting.
+    print(f"🎵 Music Search Bot is running ({UPDATE_MODE})...")
+    if UPDATE_MODE == 'webhook':
+        if not WEBHOOK_SECRET:
+            logger.warning("WEBHOOK_SECRET is not set; webhook requests are not authenticated")
+        application.run_webhook(
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            url_path=WEBHOOK_PATH,
+            webhook_url=WEBHOOK_URL,
+            secret_token=WEBHOOK_SECRET,
+            max_connections=WEBHOOK_MAX_CONNECTIONS,
+            bootstrap_retries=3
+        )
+    else:
+        application.run_polling()
+    
+    shutdown()
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -0,0 +1,145 @@
+import bisect
+import threading
+import time
+import logging
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+# Latency buckets in seconds, from cache hits up to hour-long downloads
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (
+        (name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in labels
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+class _Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+
+class Metrics:
+    """Registry of counters, gauges and latency histograms in Prometheus text format
+
+    Counters and histograms are updated by the code being measured, from any
+    thread. Gauges and counters that other components already keep are read
+    from collectors when the metrics are rendered.
+    """
+
+    def __init__(self, prefix="musicbot"):
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._meta = {}
+        self._values = {}
+        self._collectors = []
+        self._server = None
+
+    def describe(self, name, kind, help_text, buckets=DEFAULT_BUCKETS):
+        """Declare a metric; kind is 'counter', 'gauge' or 'histogram'"""
+        self._meta[name] = (kind, help_text, buckets)
+        self._values.setdefault(name, {})
+
+    def inc(self, name, value=1, **labels):
+        """Increase a counter"""
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._values[name]
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        """Record a histogram observation"""
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._values[name]
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = _Histogram(self._meta[name][2])
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """Observe the monotonic time spent in a block, also when it raises"""
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(name, time.monotonic() - started, **labels)
+
+    def add_collector(self, collector):
+        """Register collector() -> iterable of (name, labels dict, value), called on render"""
+        self._collectors.append(collector)
+
+    def render(self):
+        """Render every metric in the Prometheus text exposition format"""
+        collected = {}
+        for collector in self._collectors:
+            try:
+                for name, labels, value in collector():
+                    collected.setdefault(name, {})[tuple(sorted(labels.items()))] = value
+            except Exception as e:
+                logger.error(f"Error collecting metrics: {str(e)}")
+
+        lines = []
+        with self._lock:
+            for name, (kind, help_text, buckets) in self._meta.items():
+                full_name = f"{self.prefix}_{name}"
+                lines.append(f"# HELP {full_name} {help_text}")
+                lines.append(f"# TYPE {full_name} {kind}")
+                series = {**self._values[name], **collected.get(name, {})}
+                for key, value in sorted(series.items(), key=lambda item: item[0]):
+                    if kind != 'histogram':
+                        lines.append(f"{full_name}{_format_labels(key)} {value}")
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(buckets + (float('inf'),), value.counts):
+                        cumulative += count
+                        le = "+Inf" if bound == float('inf') else repr(float(bound))
+                        lines.append(f"{full_name}_bucket{_format_labels(key + (('le', le),))} {cumulative}")
+                    lines.append(f"{full_name}_sum{_format_labels(key)} {value.sum}")
+                    lines.append(f"{full_name}_count{_format_labels(key)} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+    def serve(self, host="127.0.0.1", port=9090):
+        """Serve /metrics over HTTP from a background thread"""
+        metrics = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), MetricsHandler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="metrics-http", daemon=True).start()
+        logger.info(f"Serving metrics on http://{host}:{port}/metrics")
+
+    def close(self):
+        """Stop the metrics endpoint"""
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
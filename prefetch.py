@@ -0,0 +1,168 @@
+import asyncio
+import json
+import os
+import time
+import logging
+from collections import Counter, OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class _PrefetchJob:
+    def __init__(self, video_id, task):
+        self.video_id = video_id
+        self.task = task
+        self.started = time.monotonic()
+        self.finished = None
+
+
+class Prefetcher:
+    """Speculatively downloads the results a user is most likely to pick
+
+    After a search, up to `candidates` results are fetched through the
+    shared download single-flight while the user is still choosing: the
+    results picked most often for that query so far, then the top-ranked
+    ones. A click then joins the in-flight download or hits the audio cache.
+    At most max_jobs speculative downloads run at once, and the others for
+    a message are cancelled as soon as one of its buttons is chosen. With
+    a choices_file, the choice counts are saved with save() and loaded
+    again on the next start.
+    """
+
+    def __init__(self, flights, fetch, is_cached, max_jobs=2, candidates=1, max_tracked=10000,
+                 choices_file=None):
+        self.flights = flights
+        self.fetch = fetch
+        self.is_cached = is_cached
+        self.max_jobs = max_jobs
+        self.candidates = candidates
+        self.max_tracked = max_tracked
+        self.choices_file = choices_file
+        # (chat_id, message_id) -> {"query": ..., "jobs": {video_id: _PrefetchJob}}
+        self._messages = OrderedDict()
+        # query -> Counter of chosen video ids
+        self._choices = OrderedDict()
+        self._running = 0
+        self.started = 0
+        self.used = 0
+        self.cancelled = 0
+        self.saved_seconds = 0.0
+
+        if choices_file:
+            self._load()
+
+    def _load(self):
+        """Load the choice counts saved by an earlier run"""
+        if not os.path.exists(self.choices_file):
+            return
+        try:
+            with open(self.choices_file, 'r') as f:
+                saved = json.load(f)
+        except Exception as e:
+            logger.error(f"Error loading prefetch choices {self.choices_file}: {str(e)}")
+            return
+
+        for query, choices in saved.items():
+            self._remember(self._choices, query, Counter(choices))
+        logger.info(f"Loaded choice counts for {len(self._choices)} queries")
+
+    def save(self):
+        """Atomically write the choice counts to choices_file, if persistence is enabled"""
+        if not self.choices_file:
+            return
+        tmp_file = f"{self.choices_file}.tmp"
+        try:
+            with open(tmp_file, 'w') as f:
+                json.dump(self._choices, f)
+            os.replace(tmp_file, self.choices_file)
+        except Exception as e:
+            logger.error(f"Error saving prefetch choices {self.choices_file}: {str(e)}")
+
+    def _remember(self, mapping, key, value):
+        mapping[key] = value
+        mapping.move_to_end(key)
+        while len(mapping) > self.max_tracked:
+            mapping.popitem(last=False)
+
+    def _rank(self, query, results):
+        """Order result ids by how often they were chosen for this query, then by rank"""
+        ids = [result['id'] for result in results]
+        choices = self._choices.get(query, Counter())
+        return sorted(ids, key=lambda video_id: (-choices[video_id], ids.index(video_id)))
+
+    def on_results(self, chat_id, message_id, query, results):
+        """Start prefetching for a results keyboard that was just sent"""
+        jobs = {}
+        self._remember(self._messages, (chat_id, message_id), {"query": query, "jobs": jobs})
+
+        for video_id in self._rank(query, results)[:self.candidates]:
+            if self._running >= self.max_jobs:
+                break
+            if self.is_cached(video_id):
+                continue
+            task = asyncio.ensure_future(self._prefetch(video_id))
+            jobs[video_id] = job = _PrefetchJob(video_id, task)
+            task.add_done_callback(lambda task, job=job: self._done(job))
+            self._running += 1
+            self.started += 1
+            logger.info(f"Prefetching {video_id} for query: {query}")
+
+    async def _prefetch(self, video_id):
+        async with self.flights.acquire(video_id, lambda: self.fetch(video_id)):
+            pass
+
+    def _done(self, job):
+        self._running -= 1
+        job.finished = time.monotonic()
+        if job.task.cancelled():
+            self.cancelled += 1
+        elif job.task.exception() is not None:
+            logger.warning(f"Prefetch of {job.video_id} failed: {str(job.task.exception())}")
+
+    def on_selected(self, chat_id, message_id, video_id):
+        """Record a choice and cancel the other prefetches for the message
+
+        Returns the prefetch of the chosen track, if there was one, to pass
+        to on_download.
+        """
+        entry = self._messages.pop((chat_id, message_id), None)
+        if entry is None:
+            return None
+
+        choices = self._choices.get(entry["query"]) or Counter()
+        choices[video_id] += 1
+        self._remember(self._choices, entry["query"], choices)
+
+        for other_id, job in entry["jobs"].items():
+            if other_id != video_id and not job.task.done():
+                job.task.cancel()
+
+        return entry["jobs"].get(video_id)
+
+    def on_download(self, job):
+        """Account the time saved if the chosen track's download reuses its prefetch
+
+        Call right before the download starts: it reuses the prefetch by
+        joining its in-flight download or finding its file in the cache.
+        """
+        if job is None:
+            return
+        if job.task.done() and (job.task.cancelled() or job.task.exception()):
+            return
+        if not (self.flights.is_in_flight(job.video_id) or self.is_cached(job.video_id)):
+            return
+        # The download started when the keyboard was sent instead of now
+        end = job.finished if job.finished is not None else time.monotonic()
+        self.used += 1
+        self.saved_seconds += end - job.started
+
+    def get_stats(self):
+        """Get prefetch usage and latency savings"""
+        return {
+            "running": self._running,
+            "started": self.started,
+            "used": self.used,
+            "cancelled": self.cancelled,
+            "saved_seconds": self.saved_seconds,
+            "avg_saved": self.saved_seconds / self.used if self.used else 0.0
+        }
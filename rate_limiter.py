@@ -0,0 +1,71 @@
+import time
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """Allows bursts of up to capacity actions, refilled at rate tokens per second"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def take(self):
+        """Take a token; returns 0 if allowed, otherwise seconds until one is available"""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class RateLimiter:
+    """Per-user token buckets for one kind of action
+
+    Each user may perform `burst` actions at once and then `per_minute`
+    actions per minute. A per_minute of 0 disables the limit. Buckets of
+    the least recently active users are dropped beyond max_users; a
+    dropped bucket would have refilled by the time it is needed again.
+    """
+
+    def __init__(self, name, per_minute, burst, max_users=10000):
+        self.name = name
+        self.rate = per_minute / 60.0
+        self.burst = max(burst, 1)
+        self.max_users = max_users
+        self.buckets = OrderedDict()
+        self.allowed = 0
+        self.rejected = 0
+
+    def check(self, user_id):
+        """Count an action by user_id; returns 0 if allowed, otherwise seconds to wait"""
+        if self.rate <= 0:
+            return 0.0
+
+        bucket = self.buckets.get(user_id)
+        if bucket is None:
+            bucket = self.buckets[user_id] = TokenBucket(self.rate, self.burst)
+            if len(self.buckets) > self.max_users:
+                self.buckets.popitem(last=False)
+        self.buckets.move_to_end(user_id)
+
+        retry_after = bucket.take()
+        if retry_after:
+            self.rejected += 1
+        else:
+            self.allowed += 1
+        return retry_after
+
+    def get_stats(self):
+        """Get allowed and rejected action counts"""
+        return {
+            "allowed": self.allowed,
+            "rejected": self.rejected,
+            "users": len(self.buckets)
+        }
@@ -0,0 +1,197 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class FairQueue:
+    """Hands out a fixed number of slots, round-robin across users when contended
+
+    Waiting jobs are queued per user and the next free slot goes to the
+    user after the one served last, so one user with many queued jobs
+    delays everyone else by at most one job per slot.
+    """
+
+    def __init__(self, slots):
+        self.slots = slots
+        self.active = 0
+        self.waiting = 0
+        # user_id -> deque of waiter futures, in round-robin order
+        self._queues = OrderedDict()
+
+    def users_waiting(self):
+        """Get the number of users with queued jobs"""
+        return len(self._queues)
+
+    def is_free(self):
+        """Check whether a job would get a slot without waiting"""
+        return self.active < self.slots and not self.waiting
+
+    async def acquire(self, user_id=None, on_queued=None):
+        """Wait for a slot; on_queued(position) is awaited if the job has to queue"""
+        if self.is_free():
+            self.active += 1
+            return
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._queues.setdefault(user_id, deque()).append(waiter)
+        self.waiting += 1
+        try:
+            if on_queued:
+                await on_queued(self.waiting)
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # A slot was already handed to us; pass it on
+                self.release()
+            else:
+                self._discard(user_id, waiter)
+            raise
+
+    def _discard(self, user_id, waiter):
+        waiters = self._queues.get(user_id)
+        if waiters and waiter in waiters:
+            waiters.remove(waiter)
+            self.waiting -= 1
+            if not waiters:
+                del self._queues[user_id]
+
+    def release(self):
+        """Free a slot, handing it to the next user in line"""
+        while self._queues:
+            user_id, waiters = next(iter(self._queues.items()))
+            waiter = waiters.popleft()
+            self.waiting -= 1
+            if waiters:
+                self._queues.move_to_end(user_id)
+            else:
+                del self._queues[user_id]
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+
+class JobPool:
+    """Worker pool for a single job type with its own concurrency limit
+
+    Jobs are dispatched to the workers fairly across users. If given,
+    on_wait(name, seconds) is called with each job's time in the queue.
+    """
+
+    def __init__(self, name, max_workers, on_wait=None):
+        self.name = name
+        self.max_workers = max_workers
+        self.on_wait = on_wait
+        self.slots = FairQueue(max_workers)
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers,
+            thread_name_prefix=f"{name}-worker"
+        )
+        self._lock = threading.Lock()
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    async def run(self, func, *args, user_id=None):
+        """Run func(*args) on a worker thread for user_id and wait for the result"""
+        loop = asyncio.get_running_loop()
+        submitted = time.monotonic()
+        started = threading.Event()
+
+        with self._lock:
+            self.queued += 1
+
+        try:
+            await self.slots.acquire(user_id)
+        except asyncio.CancelledError:
+            with self._lock:
+                self.queued -= 1
+            raise
+
+        def job():
+            wait = time.monotonic() - submitted
+            with self._lock:
+                self.queued -= 1
+                self.running += 1
+                self.total_wait += wait
+                self.max_wait = max(self.max_wait, wait)
+            started.set()
+            if self.on_wait:
+                self.on_wait(self.name, wait)
+            try:
+                return func(*args)
+            finally:
+                with self._lock:
+                    self.running -= 1
+
+        try:
+            result = await loop.run_in_executor(self.executor, job)
+        except asyncio.CancelledError:
+            # A job cancelled before a worker picked it up never runs
+            if not started.is_set():
+                with self._lock:
+                    self.queued -= 1
+            raise
+        except Exception:
+            with self._lock:
+                self.failed += 1
+            raise
+        finally:
+            self.slots.release()
+
+        with self._lock:
+            self.completed += 1
+        return result
+
+    def get_stats(self):
+        """Get queue depth and wait-time statistics for this pool"""
+        with self._lock:
+            finished = self.completed + self.failed
+            return {
+                "max_workers": self.max_workers,
+                "queue_depth": self.queued,
+                "running": self.running,
+                "users_waiting": self.slots.users_waiting(),
+                "completed": self.completed,
+                "failed": self.failed,
+                "avg_wait": self.total_wait / finished if finished else 0.0,
+                "max_wait": self.max_wait
+            }
+
+
+class JobScheduler:
+    """Runs blocking jobs off the event loop on per-job-type worker pools"""
+
+    def __init__(self, limits, on_wait=None):
+        self.pools = {
+            name: JobPool(name, max_workers, on_wait)
+            for name, max_workers in limits.items()
+        }
+        logger.info(
+            "Job scheduler started with pools: " +
+            ", ".join(f"{name}={pool.max_workers}" for name, pool in self.pools.items())
+        )
+
+    async def run(self, job_type, func, *args, user_id=None):
+        """Schedule func(*args) for user_id on the pool for job_type and await its result"""
+        pool = self.pools.get(job_type)
+        if pool is None:
+            raise ValueError(f"Unknown job type: {job_type}")
+        return await pool.run(func, *args, user_id=user_id)
+
+    def get_stats(self):
+        """Get statistics for every pool"""
+        return {name: pool.get_stats() for name, pool in self.pools.items()}
+
+    def shutdown(self, wait=True):
+        """Stop all worker pools"""
+        for pool in self.pools.values():
+            pool.executor.shutdown(wait=wait, cancel_futures=True)
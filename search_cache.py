@@ -0,0 +1,128 @@
+import asyncio
+import json
+import os
+import time
+import logging
+from collections import OrderedDict
+from single_flight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+
+class SearchCache:
+    """Size-bounded LRU cache of search results with TTL expiry
+
+    Entries younger than ttl are served as fresh hits. Entries that expired
+    less than stale_ttl ago are still served, but trigger a background
+    refresh (stale-while-revalidate). Concurrent misses for the same key
+    share a single fetch.
+    """
+
+    def __init__(self, max_entries=1000, ttl=3600, stale_ttl=86400, cache_file=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.cache_file = cache_file
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self._fetches = SingleFlight()
+        self._refresh_tasks = set()
+
+        if cache_file:
+            self._load()
+
+    def _load(self):
+        """Load entries saved by an earlier run, skipping expired ones"""
+        if not os.path.exists(self.cache_file):
+            return
+        try:
+            with open(self.cache_file, 'r') as f:
+                saved = json.load(f)
+        except Exception as e:
+            logger.error(f"Error loading search cache {self.cache_file}: {str(e)}")
+            return
+
+        now = time.time()
+        for key, entry in saved.items():
+            if now - entry["fetched_at"] < self.ttl + self.stale_ttl:
+                self.entries[key] = (entry["results"], entry["fetched_at"])
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        logger.info(f"Loaded {len(self.entries)} cached searches")
+
+    def save(self):
+        """Atomically write the cache to cache_file, if persistence is enabled"""
+        if not self.cache_file:
+            return
+        tmp_file = f"{self.cache_file}.tmp"
+        try:
+            with open(tmp_file, 'w') as f:
+                json.dump({
+                    key: {"results": results, "fetched_at": fetched_at}
+                    for key, (results, fetched_at) in self.entries.items()
+                }, f)
+            os.replace(tmp_file, self.cache_file)
+        except Exception as e:
+            logger.error(f"Error saving search cache {self.cache_file}: {str(e)}")
+
+    def put(self, key, results):
+        """Store results for key, evicting the least recently used entries"""
+        self.entries[key] = (results, time.time())
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    async def _fetch(self, key, fetch):
+        async with self._fetches.acquire(key, fetch) as results:
+            # Empty results are usually transient, so they are not cached
+            if results:
+                self.put(key, results)
+            return results
+
+    def _refresh(self, key, fetch):
+        if self._fetches.is_in_flight(key):
+            return
+        self.refreshes += 1
+        task = asyncio.ensure_future(self._fetch(key, fetch))
+        self._refresh_tasks.add(task)
+        task.add_done_callback(self._refresh_done)
+
+    def _refresh_done(self, task):
+        self._refresh_tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning(f"Background search refresh failed: {str(task.exception())}")
+
+    async def get(self, key, fetch):
+        """Get cached results for key, calling the async fetch() on a miss"""
+        entry = self.entries.get(key)
+        if entry:
+            results, fetched_at = entry
+            age = time.time() - fetched_at
+            if age < self.ttl:
+                self.hits += 1
+                self.entries.move_to_end(key)
+                return results
+            if age < self.ttl + self.stale_ttl:
+                self.stale_hits += 1
+                self.entries.move_to_end(key)
+                self._refresh(key, fetch)
+                return results
+            del self.entries[key]
+
+        self.misses += 1
+        return await self._fetch(key, fetch)
+
+    def get_stats(self):
+        """Get cache size and hit statistics"""
+        lookups = self.hits + self.stale_hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "refreshes": self.refreshes,
+            "hit_rate": (self.hits + self.stale_hits) / lookups if lookups else 0.0
+        }
@@ -0,0 +1,81 @@
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+
+logger = logging.getLogger(__name__)
+
+
+class _Flight:
+    def __init__(self, task):
+        self.task = task
+        self.refs = 0
+
+
+class SingleFlight:
+    """Coalesces concurrent requests for the same key into one in-flight job
+
+    The first caller for a key starts the job; callers arriving while it is
+    still in flight (or still in use) share its result. Once the last caller
+    releases the result, on_release is called with it, e.g. to clean up files.
+    """
+
+    def __init__(self, on_release=None):
+        self.on_release = on_release
+        self._flights = {}
+        self.started = 0
+        self.coalesced = 0
+
+    @asynccontextmanager
+    async def acquire(self, key, func):
+        """Run func() once per key and yield the shared result"""
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = _Flight(asyncio.ensure_future(func()))
+            self._flights[key] = flight
+            self.started += 1
+        else:
+            self.coalesced += 1
+            logger.info(f"Coalesced request for {key} into in-flight job")
+
+        flight.refs += 1
+        try:
+            # Shield the shared job so one cancelled caller doesn't cancel it for everyone
+            yield await asyncio.shield(flight.task)
+        finally:
+            flight.refs -= 1
+            if flight.refs == 0:
+                self._finish(key, flight)
+
+    def _finish(self, key, flight):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+        if flight.task.done():
+            self._release(flight.task)
+        else:
+            # Nobody is waiting for the result anymore
+            flight.task.cancel()
+            flight.task.add_done_callback(self._release)
+
+    def _release(self, task):
+        if self.on_release is None or task.cancelled() or task.exception() is not None:
+            return
+        try:
+            self.on_release(task.result())
+        except Exception as e:
+            logger.error(f"Error releasing single-flight result: {str(e)}")
+
+    def in_flight(self):
+        """Get the number of keys with an active job"""
+        return len(self._flights)
+
+    def is_in_flight(self, key):
+        """Check whether a job for key is currently active"""
+        return key in self._flights
+
+    def get_stats(self):
+        """Get started and coalesced request counts"""
+        return {
+            "in_flight": len(self._flights),
+            "started": self.started,
+            "coalesced": self.coalesced
+        }
@@ -0,0 +1,159 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+import logging
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# Innermost functions of threads that are idle rather than working
+IDLE_FUNCTIONS = {'wait', 'select', 'poll', '_worker'}
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+
+
+def _coroutine_stack(task):
+    """Get the chain of awaits a task is suspended in, outermost first"""
+    stack = []
+    awaitable = task.get_coro()
+    while awaitable is not None and len(stack) < 100:
+        frame = (
+            getattr(awaitable, 'cr_frame', None)
+            or getattr(awaitable, 'gi_frame', None)
+            or getattr(awaitable, 'ag_frame', None)
+        )
+        if frame is None:
+            stack.append(f"<{type(awaitable).__name__}>")
+            break
+        stack.append(_frame_name(frame))
+        awaitable = (
+            getattr(awaitable, 'cr_await', None)
+            or getattr(awaitable, 'gi_yieldfrom', None)
+            or getattr(awaitable, 'ag_await', None)
+        )
+    return ";".join(stack)
+
+
+def _thread_stacks(skip):
+    """Get the stacks of threads that are busy, outermost frame first"""
+    names = {thread.ident: thread.name for thread in threading.enumerate()}
+    stacks = []
+    for ident, frame in sys._current_frames().items():
+        if ident == skip or frame.f_code.co_name in IDLE_FUNCTIONS:
+            continue
+        frames = []
+        while frame is not None and len(frames) < 100:
+            frames.append(_frame_name(frame))
+            frame = frame.f_back
+        stacks.append(f"{names.get(ident, ident)};" + ";".join(reversed(frames)))
+    return stacks
+
+
+class SlowRequestProfiler:
+    """Samples the stacks of requests that run longer than a threshold
+
+    A background thread looks at the tracked requests every interval
+    seconds. Once a request is slower than threshold, each sample records
+    where its task is awaiting and what every busy thread, including the
+    event loop and the worker pools, is executing. When the slow request
+    finishes, the sampled stacks are written to log_file in folded format
+    (one "frame;frame;frame count" line per stack), which flame graph tools
+    read directly. All file writes happen on the sampling thread.
+    """
+
+    def __init__(self, threshold, interval=0.05, log_file=os.path.join("data", "slow_requests.log")):
+        self.threshold = threshold
+        self.interval = interval
+        self.log_file = log_file
+        self.reported = 0
+        self._lock = threading.Lock()
+        self._requests = {}
+        self._reports = []
+        self._next_id = 0
+        self._stop = threading.Event()
+
+        os.makedirs(os.path.dirname(log_file) or ".", exist_ok=True)
+        self._thread = threading.Thread(target=self._run, name="slow-request-profiler", daemon=True)
+        self._thread.start()
+
+    @contextmanager
+    def track(self, name):
+        """Profile the current asyncio task while the block runs"""
+        with self._lock:
+            request_id = self._next_id
+            self._next_id += 1
+            self._requests[request_id] = {
+                "name": name,
+                "task": asyncio.current_task(),
+                "started": time.monotonic(),
+                "samples": Counter()
+            }
+        try:
+            yield
+        finally:
+            with self._lock:
+                request = self._requests.pop(request_id)
+                duration = time.monotonic() - request["started"]
+                if request["samples"]:
+                    self._reports.append((request, duration))
+
+    def _sample(self):
+        now = time.monotonic()
+        with self._lock:
+            slow = [
+                request for request in self._requests.values()
+                if now - request["started"] >= self.threshold
+            ]
+        if not slow:
+            return
+
+        threads = _thread_stacks(skip=threading.get_ident())
+        for request in slow:
+            stacks = [f"task;{_coroutine_stack(request['task'])}"] if request["task"] else []
+            stacks += [f"thread {stack}" for stack in threads]
+            with self._lock:
+                request["samples"].update(stacks)
+
+    def _write_reports(self):
+        with self._lock:
+            reports, self._reports = self._reports, []
+        if not reports:
+            return
+        try:
+            with open(self.log_file, 'a') as f:
+                for request, duration in reports:
+                    f.write(
+                        f"# {datetime.now().isoformat()} {request['name']} took {duration:.2f}s "
+                        f"(threshold {self.threshold}s, sampled every {self.interval}s)\n"
+                    )
+                    for stack, count in request["samples"].most_common():
+                        f.write(f"{stack} {count}\n")
+                    f.write("\n")
+            self.reported += len(reports)
+            logger.warning(
+                f"Profiled {len(reports)} slow requests: " +
+                ", ".join(f"{request['name']} ({duration:.1f}s)" for request, duration in reports)
+            )
+        except Exception as e:
+            logger.error(f"Error writing slow request profiles: {str(e)}")
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self._sample()
+            except Exception as e:
+                logger.error(f"Error sampling slow requests: {str(e)}")
+            self._write_reports()
+        self._write_reports()
+
+    def close(self):
+        """Stop sampling and write out pending reports"""
+        self._stop.set()
+        self._thread.join()
@@ -0,0 +1,140 @@
+import json
+import os
+import threading
+import logging
+from datetime import datetime
+from heavy_hitters import WindowedTopK
+
+logger = logging.getLogger(__name__)
+
+# Longest query or artist name tracked as popular; longer text is cut
+MAX_TEXT_LENGTH = 100
+
+
+class StatsAggregator:
+    """Keeps bot statistics in memory and checkpoints them to disk
+
+    Events only update in-memory counters. A background thread writes a
+    snapshot every checkpoint_interval seconds when something changed, and
+    close() writes a final one. Snapshots are written to a temporary file
+    and atomically renamed, so a crash never leaves a half-written file.
+    """
+
+    def __init__(self, stats_file, checkpoint_interval=60.0, top_k_capacity=1000):
+        self.stats_file = stats_file
+        self.checkpoint_interval = checkpoint_interval
+        self.top_k_capacity = top_k_capacity
+        self._lock = threading.Lock()
+        self._dirty = False
+        self.stats = self._load()
+
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stats-checkpoint", daemon=True)
+        self._thread.start()
+
+    def _load(self):
+        """Load the last checkpoint, or start with empty statistics"""
+        stats = {
+            "total_searches": 0,
+            "total_downloads": 0,
+            "total_errors": 0,
+            "popular_searches": {},
+            "popular_artists": {},
+            "last_updated": datetime.now().isoformat()
+        }
+        if os.path.exists(self.stats_file):
+            try:
+                with open(self.stats_file, 'r') as f:
+                    stats.update(json.load(f))
+            except Exception as e:
+                logger.error(f"Error loading stats from {self.stats_file}: {str(e)}")
+        else:
+            self._dirty = True
+
+        # Popular searches and artists are bounded-size heavy-hitter sketches
+        for key in ("popular_searches", "popular_artists"):
+            stats[key] = WindowedTopK.from_dict(stats[key], capacity=self.top_k_capacity)
+        return stats
+
+    @staticmethod
+    def _normalize(text):
+        return " ".join(text.lower().split())[:MAX_TEXT_LENGTH]
+
+    def _touch(self):
+        self.stats["last_updated"] = datetime.now().isoformat()
+        self._dirty = True
+
+    def record_search(self, query):
+        """Count a search and its query"""
+        query = self._normalize(query)
+        with self._lock:
+            self.stats["total_searches"] += 1
+            if query:
+                self.stats["popular_searches"].add(query)
+            self._touch()
+
+    def record_download(self, artist):
+        """Count a download and its artist"""
+        artist = self._normalize(artist)
+        with self._lock:
+            self.stats["total_downloads"] += 1
+            if artist:
+                self.stats["popular_artists"].add(artist)
+            self._touch()
+
+    def record_error(self):
+        """Count an error"""
+        with self._lock:
+            self.stats["total_errors"] += 1
+            self._touch()
+
+    def snapshot(self, window=None, top_n=5):
+        """Get the current totals and the top_n popular searches and artists
+
+        window can be "hour", "day" or "week" to rank only recent activity.
+        """
+        with self._lock:
+            snapshot = {
+                key: value for key, value in self.stats.items()
+                if key not in ("popular_searches", "popular_artists")
+            }
+            snapshot["popular_searches"] = self.stats["popular_searches"].top(top_n, window)
+            snapshot["popular_artists"] = self.stats["popular_artists"].top(top_n, window)
+            return snapshot
+
+    def _serialize(self):
+        data = dict(self.stats)
+        data["popular_searches"] = self.stats["popular_searches"].to_dict()
+        data["popular_artists"] = self.stats["popular_artists"].to_dict()
+        return json.dumps(data, indent=4)
+
+    def checkpoint(self):
+        """Atomically write the current statistics to disk if they changed"""
+        with self._lock:
+            if not self._dirty:
+                return
+            data = self._serialize()
+            self._dirty = False
+
+        tmp_file = f"{self.stats_file}.tmp"
+        try:
+            with open(tmp_file, 'w') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_file, self.stats_file)
+        except Exception as e:
+            with self._lock:
+                self._dirty = True
+            logger.error(f"Error writing stats checkpoint: {str(e)}")
+
+    def _run(self):
+        while not self._stop.wait(self.checkpoint_interval):
+            self.checkpoint()
+
+    def close(self):
+        """Stop the checkpoint thread and write a final checkpoint"""
+        if not self._stop.is_set():
+            self._stop.set()
+            self._thread.join()
+        self.checkpoint()
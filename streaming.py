@@ -0,0 +1,57 @@
+import io
+import logging
+
+logger = logging.getLogger(__name__)
+
+# YouTube throttles single large requests, so streams are read in ranges
+DEFAULT_CHUNK_SIZE = 10 * 1024 * 1024
+
+
+class StreamError(Exception):
+    """Raised when a track cannot be streamed and needs the file-based path"""
+
+
+class StreamTooLargeError(StreamError):
+    """Raised when a stream exceeds the in-memory buffer limit"""
+
+
+def resolve_stream(ydl_pool, video_id):
+    """Get the video info, including the direct URL of the selected audio format"""
+    with ydl_pool.lease('metadata') as ydl:
+        info = ydl.extract_info(f"https://www.youtube.com/watch?v={video_id}", download=False)
+
+    if info.get('protocol') not in ('http', 'https') or not info.get('url'):
+        raise StreamError(f"Format {info.get('format_id')} of {video_id} is not a plain HTTP stream")
+    return info
+
+
+def read_stream(session, info, max_bytes, cancel_event=None):
+    """Read the selected format of a resolved video into memory
+
+    The stream is fetched in ranged chunks into a buffer of at most
+    max_bytes; larger streams raise StreamTooLargeError.
+    """
+    chunk_size = (info.get('downloader_options') or {}).get('http_chunk_size') or DEFAULT_CHUNK_SIZE
+    headers = dict(info.get('http_headers') or {})
+    buffer = io.BytesIO()
+
+    while True:
+        start = buffer.tell()
+        headers['Range'] = f"bytes={start}-{start + chunk_size - 1}"
+        with session.get(info['url'], headers=headers, stream=True, timeout=30) as response:
+            response.raise_for_status()
+            for block in response.iter_content(64 * 1024):
+                if cancel_event is not None and cancel_event.is_set():
+                    raise StreamError("Stream cancelled")
+                buffer.write(block)
+                if buffer.tell() > max_bytes:
+                    raise StreamTooLargeError(f"Stream is larger than {max_bytes} bytes")
+
+            # A server that ignores Range sends the whole stream at once
+            if response.status_code != 206:
+                break
+            total = response.headers.get('Content-Range', '').rpartition('/')[2]
+            if buffer.tell() - start < chunk_size or (total.isdigit() and buffer.tell() >= int(total)):
+                break
+
+    return buffer.getvalue()
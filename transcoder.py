@@ -0,0 +1,205 @@
+import asyncio
+import glob
+import multiprocessing
+import os
+import subprocess
+import time
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from streaming import StreamTooLargeError
+from scheduler import FairQueue
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFullError(Exception):
+    """Raised when the transcode queue cannot take another job"""
+
+
+def transcode_to_mp3(source, target, quality):
+    """Transcode an audio file to MP3 with FFmpeg, using a single core"""
+    subprocess.run(
+        [
+            'ffmpeg', '-nostdin', '-loglevel', 'error', '-y',
+            '-i', source,
+            '-vn', '-threads', '1',
+            '-codec:a', 'libmp3lame', '-b:a', f'{quality}k',
+            target
+        ],
+        check=True,
+        capture_output=True
+    )
+    return target
+
+
+def split_audio(source, target_prefix, parts, duration=None):
+    """Split an audio file into parts of about equal length without re-encoding
+
+    The duration is read with ffprobe if not given. Returns the part files,
+    named <target_prefix>.partNN<ext>, in order.
+    """
+    if not duration:
+        duration = float(subprocess.run(
+            [
+                'ffprobe', '-loglevel', 'error',
+                '-show_entries', 'format=duration', '-of', 'default=noprint_wrappers=1:nokey=1',
+                source
+            ],
+            check=True,
+            capture_output=True,
+            text=True
+        ).stdout)
+    ext = os.path.splitext(source)[1]
+    # A little over an even share, so rounding never leaves a tiny extra part
+    segment_time = duration / parts + 1
+    subprocess.run(
+        [
+            'ffmpeg', '-nostdin', '-loglevel', 'error', '-y',
+            '-i', source,
+            '-map', '0:a', '-codec', 'copy',
+            '-f', 'segment', '-segment_time', f'{segment_time:.3f}', '-reset_timestamps', '1',
+            f'{target_prefix}.part%02d{ext}'
+        ],
+        check=True,
+        capture_output=True
+    )
+    return sorted(glob.glob(f'{glob.escape(target_prefix)}.part*{ext}'))
+
+
+def transcode_stream_to_mp3(url, http_headers, quality, max_bytes):
+    """Transcode a remote audio stream to MP3 in memory, using a single core
+
+    FFmpeg reads the stream directly and writes MP3 to a pipe, so nothing
+    touches the disk. Output larger than max_bytes raises StreamTooLargeError.
+    """
+    headers = "".join(f"{name}: {value}\r\n" for name, value in http_headers.items())
+    command = [
+        'ffmpeg', '-nostdin', '-loglevel', 'error',
+        '-headers', headers,
+        '-i', url,
+        '-vn', '-threads', '1',
+        '-codec:a', 'libmp3lame', '-b:a', f'{quality}k',
+        '-f', 'mp3', 'pipe:1'
+    ]
+    data = bytearray()
+    with subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL) as process:
+        while True:
+            block = process.stdout.read(64 * 1024)
+            if not block:
+                break
+            data += block
+            if len(data) > max_bytes:
+                process.kill()
+                raise StreamTooLargeError(f"Transcoded stream is larger than {max_bytes} bytes")
+        if process.wait() != 0:
+            raise subprocess.CalledProcessError(process.returncode, command[0])
+    return bytes(data)
+
+
+def _child_cpu_time():
+    if resource is None:
+        return 0.0
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _run_job(func, *args):
+    """Run a job in a worker process and measure its busy and CPU time
+
+    Each worker runs one job at a time, so the child CPU time it measures
+    belongs to this job alone.
+    """
+    started = time.monotonic()
+    cpu_start = time.process_time() + _child_cpu_time()
+    result = func(*args)
+    cpu_seconds = time.process_time() + _child_cpu_time() - cpu_start
+    return os.getpid(), time.monotonic() - started, cpu_seconds, result
+
+
+class TranscodePool:
+    """Process pool for CPU-heavy transcodes, sized to the number of cores
+
+    At most max_workers jobs run at once. Further jobs wait in a queue of
+    at most max_queue entries, served round-robin across users; when that
+    is full, new jobs are rejected with QueueFullError instead of piling up.
+    If given, on_wait(seconds) is called with each job's time in the queue.
+
+    The worker processes are forked where possible, so they don't re-import
+    the bot module and repeat its startup work. They are started right
+    away: create the pool before the process starts any threads, since a
+    forked worker inherits every lock another thread holds at that moment
+    and could deadlock on it.
+    """
+
+    def __init__(self, max_workers=None, max_queue=100, on_wait=None):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_queue = max_queue
+        self.on_wait = on_wait
+        self.started_at = time.monotonic()
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.cpu_seconds = 0.0
+        self.busy_seconds = {}
+        self._slots = FairQueue(self.max_workers)
+
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context('fork' if 'fork' in methods else None)
+        self._executor = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=context)
+        # A forking pool starts all of its workers with the first job
+        self._executor.submit(os.getpid).result()
+
+    async def run(self, func, *args, on_queued=None, user_id=None):
+        """Run func(*args) for user_id in a worker process and return (result, cpu_seconds)
+
+        If every worker is busy, the job is queued and the optional async
+        on_queued(position) callback is awaited with its queue position.
+        """
+        if not self._slots.is_free() and self._slots.waiting >= self.max_queue:
+            self.rejected += 1
+            raise QueueFullError(f"Transcode queue is full ({self.max_queue} jobs waiting)")
+        submitted = time.monotonic()
+        await self._slots.acquire(user_id, on_queued)
+        if self.on_wait:
+            self.on_wait(time.monotonic() - submitted)
+        try:
+            loop = asyncio.get_running_loop()
+            pid, busy, cpu_seconds, result = await loop.run_in_executor(
+                self._executor, _run_job, func, *args
+            )
+        except Exception:
+            self.failed += 1
+            raise
+        finally:
+            self._slots.release()
+
+        self.completed += 1
+        self.cpu_seconds += cpu_seconds
+        self.busy_seconds[pid] = self.busy_seconds.get(pid, 0.0) + busy
+        return result, cpu_seconds
+
+    def get_stats(self):
+        """Get queue and per-worker utilization statistics"""
+        uptime = max(time.monotonic() - self.started_at, 1e-9)
+        utilization = {pid: busy / uptime for pid, busy in self.busy_seconds.items()}
+        return {
+            "max_workers": self.max_workers,
+            "running": self._slots.active,
+            "queue_depth": self._slots.waiting,
+            "users_waiting": self._slots.users_waiting(),
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "cpu_seconds": self.cpu_seconds,
+            "worker_utilization": utilization,
+            "avg_utilization": sum(utilization.values()) / self.max_workers
+        }
+
+    def shutdown(self, wait=True):
+        """Stop the worker processes"""
+        self._executor.shutdown(wait=wait, cancel_futures=True)
@@ -0,0 +1,72 @@
+import math
+
+# Container and metadata overhead on top of the audio bitrate
+OVERHEAD = 1.05
+
+# Share of the upload limit a part is planned to fill, leaving room for
+# bitrate variation and the multipart request
+HEADROOM = 0.95
+
+
+class TrackTooLargeError(Exception):
+    """Raised when a track can't be uploaded within the limit, even in parts"""
+
+
+def estimate_bytes(duration, kbps):
+    """Estimate the size of duration seconds of audio at kbps"""
+    return duration * kbps * 1000 / 8 * OVERHEAD
+
+
+class UploadPlanner:
+    """Decides how a track fits the upload limit before it is downloaded
+
+    A track whose estimated size at the nominal bitrate fits is delivered
+    as usual. Otherwise it gets the highest fallback bitrate that fits, and
+    if none does, it is split into parts at the nominal bitrate. Tracks that
+    would need more than max_parts parts are rejected. Plans are based on
+    the duration, which search results already provide; the real file size
+    is checked again after the download with parts_for.
+    """
+
+    def __init__(self, limit_bytes, nominal_kbps, fallback_kbps=(), max_parts=4):
+        self.limit_bytes = limit_bytes
+        self.target_bytes = limit_bytes * HEADROOM
+        self.nominal_kbps = nominal_kbps
+        self.fallback_kbps = sorted((kbps for kbps in fallback_kbps if kbps < nominal_kbps), reverse=True)
+        self.max_parts = max(max_parts, 1)
+
+    def max_duration(self):
+        """Get the longest track in seconds that can be delivered, in parts if need be"""
+        return self.target_bytes * self.max_parts / estimate_bytes(1, self.nominal_kbps)
+
+    def plan(self, duration):
+        """Plan a track of duration seconds (None if unknown)
+
+        Returns {'kbps': a fallback bitrate or None for the nominal one,
+        'parts': number of parts, 'size': estimated bytes or None}. Raises
+        TrackTooLargeError if the track can't be delivered.
+        """
+        if not duration:
+            return {'kbps': None, 'parts': 1, 'size': None}
+
+        size = estimate_bytes(duration, self.nominal_kbps)
+        if size <= self.target_bytes:
+            return {'kbps': None, 'parts': 1, 'size': size}
+
+        for kbps in self.fallback_kbps:
+            lowered = estimate_bytes(duration, kbps)
+            if lowered <= self.target_bytes:
+                return {'kbps': kbps, 'parts': 1, 'size': lowered}
+
+        return {'kbps': None, 'parts': self.parts_for(size, duration), 'size': size}
+
+    def parts_for(self, size, duration=None):
+        """Get the number of parts a file of size bytes has to be split into"""
+        parts = max(math.ceil(size / self.target_bytes), 1)
+        if parts > self.max_parts:
+            length = f"{duration / 60:.0f} min, " if duration else ""
+            raise TrackTooLargeError(
+                f"Track ({length}~{size / 1024 / 1024:.0f} MB) would need {parts} parts "
+                f"of at most {self.limit_bytes / 1024 / 1024:.0f} MB; the limit is {self.max_parts}"
+            )
+        return parts
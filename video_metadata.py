@@ -0,0 +1,64 @@
+import threading
+from collections import OrderedDict
+
+
+class VideoMetadataStore:
+    """Shared LRU store of video metadata (id -> title, artist, duration, views)
+
+    Search results, downloads and oEmbed lookups all feed the store, so a
+    video's metadata only has to be fetched from YouTube once.
+    """
+
+    FIELDS = ("title", "artist", "duration", "views")
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, video_id):
+        """Get the metadata for a video, or None if it is unknown"""
+        with self._lock:
+            entry = self.entries.get(video_id)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries.move_to_end(video_id)
+            return dict(entry)
+
+    def put(self, video_id, **fields):
+        """Store metadata for a video, keeping known values for missing fields"""
+        with self._lock:
+            entry = self.entries.setdefault(video_id, {})
+            entry.update({
+                key: value for key, value in fields.items()
+                if key in self.FIELDS and value is not None
+            })
+            self.entries.move_to_end(video_id)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+            return dict(entry)
+
+    def put_info(self, info):
+        """Store metadata from a yt-dlp info dict"""
+        return self.put(
+            info['id'],
+            title=info.get('title'),
+            artist=info.get('uploader'),
+            duration=info.get('duration'),
+            views=info.get('view_count')
+        )
+
+    def get_stats(self):
+        """Get store size and hit statistics"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0
+            }
@@ -0,0 +1,207 @@
+"""Download worker for bots running with DOWNLOAD_BACKEND=queue
+
+Claims download jobs from the durable job queue, downloads and uploads the
+tracks and reports the results back through the queue. Run as many as the
+host has capacity for, on any host that shares the queue file:
+
+    python worker.py [--name NAME] [--jobs N] [--transcode-workers N] [--metrics-port PORT]
+
+A worker keeps its audio cache in downloads/workers/<name>. Give workers
+stable names to keep their caches across restarts; unnamed workers use a
+throwaway cache that is removed when they exit. With --metrics-port, a
+worker serves its download stage timings and pool gauges on
+http://METRICS_HOST:PORT/metrics like the bot does.
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import signal
+import socket
+import logging
+from upload_limits import TrackTooLargeError
+
+logger = logging.getLogger(__name__)
+
+
+class Worker:
+    """Runs queued download jobs, at most max_jobs at a time"""
+
+    def __init__(self, bot, name, max_jobs, poll_interval=1.0, retry_delay=10.0):
+        self.bot = bot
+        self.queue = bot.download_queue
+        self.name = name
+        self.max_jobs = max_jobs
+        self.poll_interval = poll_interval
+        self.retry_delay = retry_delay
+        self.stopping = asyncio.Event()
+        self.telegram = None
+
+    async def run(self):
+        """Claim and run jobs until SIGINT or SIGTERM, then finish the running ones"""
+        from telegram import Bot
+
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, self.stopping.set)
+
+        slots = asyncio.Semaphore(self.max_jobs)
+        tasks = set()
+        async with Bot(self.bot.TOKEN, base_url=self.bot.BOT_API_BASE_URL) as self.telegram:
+            logger.info(f"Worker {self.name} started with {self.max_jobs} job slots")
+            while not self.stopping.is_set():
+                await slots.acquire()
+                try:
+                    job = await asyncio.to_thread(self.queue.claim, self.name)
+                except Exception as e:
+                    logger.error(f"Error claiming a job: {str(e)}")
+                    job = None
+                if job is None:
+                    slots.release()
+                    try:
+                        await asyncio.wait_for(self.stopping.wait(), self.poll_interval)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+
+                task = asyncio.create_task(self.handle(job))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+                task.add_done_callback(lambda task: slots.release())
+
+            logger.info(f"Worker {self.name} stopping, waiting for {len(tasks)} running jobs")
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def keep_leased(self, job, task):
+        """Renew a job's lease while it runs, cancelling task if the lease is lost"""
+        while True:
+            await asyncio.sleep(self.queue.lease_seconds / 3)
+            if not await self.renew(job):
+                job['lease_lost'] = True
+                task.cancel()
+                return
+
+    async def renew(self, job):
+        """Extend a job's lease; returns False if another worker may have claimed it"""
+        try:
+            if await asyncio.to_thread(self.queue.renew, job['id'], self.name):
+                return True
+        except Exception as e:
+            logger.error(f"Error renewing the lease of job {job['id']}: {str(e)}")
+        logger.warning(f"Lost the lease of job {job['id']}, dropping it")
+        return False
+
+    async def handle(self, job):
+        """Download and deliver one job's track"""
+        video_id = job['video_id']
+        if job['attempts'] > self.queue.max_attempts:
+            await self.give_up(job, "Job lease expired too many times")
+            return
+
+        logger.info(f"Job {job['id']}: downloading {video_id} (attempt {job['attempts']})")
+        renewer = asyncio.create_task(self.keep_leased(job, asyncio.current_task()))
+        try:
+            async with self.bot.download_flights.acquire(
+                video_id,
+                lambda: self.bot.fetch_audio(video_id, user_id=job['user_id'])
+            ) as result:
+                # The renewer only checks every third of the lease, so make
+                # sure no other worker took the job over before sending it
+                if not await self.renew(job):
+                    return
+                sent = await self.bot.send_audio(self.telegram, job['chat_id'], result)
+        except asyncio.CancelledError:
+            if not job.get('lease_lost'):
+                raise
+            # Another worker may already be running the job; leave it to that one
+            return
+        except TrackTooLargeError as e:
+            # Retrying won't make the track any shorter
+            logger.warning(f"Job {job['id']}: {str(e)}")
+            await self.give_up(job, str(e), "🚫 This track is too long to send on Telegram.")
+            return
+        except Exception as e:
+            error_msg = f"Error downloading video {video_id}: {str(e)}"
+            logger.error(f"Job {job['id']}: {error_msg}")
+            if job['attempts'] < self.queue.max_attempts:
+                # Back off a little longer after every failed attempt
+                await asyncio.to_thread(
+                    self.queue.fail, job['id'], self.name, error_msg, self.retry_delay * job['attempts']
+                )
+            else:
+                await self.give_up(job, error_msg)
+            return
+        finally:
+            renewer.cancel()
+
+        await asyncio.to_thread(
+            self.queue.complete,
+            job['id'],
+            self.name,
+            sent.audio.file_id if sent and sent.audio else None,
+            result['title'],
+            result['artist']
+        )
+        await self.delete_status(job)
+
+    async def give_up(self, job, error_msg, reply="❌ An error occurred while downloading. Please try again later."):
+        """Fail a job for good and tell the user"""
+        await asyncio.to_thread(self.queue.fail, job['id'], self.name, error_msg)
+        await self.delete_status(job)
+        try:
+            await self.telegram.send_message(job['chat_id'], reply)
+        except Exception as e:
+            logger.warning(f"Could not notify chat {job['chat_id']}: {str(e)}")
+
+    async def delete_status(self, job):
+        """Delete the job's "Queued for download" message"""
+        if job['message_id'] is None:
+            return
+        try:
+            await self.telegram.delete_message(job['chat_id'], job['message_id'])
+        except Exception as e:
+            logger.warning(f"Could not delete status message of job {job['id']}: {str(e)}")
+
+
+def main():
+    """Start a download worker"""
+    parser = argparse.ArgumentParser(description="Download worker for DOWNLOAD_BACKEND=queue")
+    parser.add_argument('--name', help="stable worker name; also names its audio cache")
+    parser.add_argument('--jobs', type=int, help="jobs run at once (default: DOWNLOAD_WORKERS)")
+    parser.add_argument(
+        '--transcode-workers', type=int,
+        help="transcode processes (default: one per job, at most one per core)"
+    )
+    parser.add_argument('--metrics-port', type=int, help="serve Prometheus metrics on this port")
+    args = parser.parse_args()
+
+    name = args.name or f"{socket.gethostname()}-{os.getpid()}"
+    # Every worker needs its own audio cache, since a cache clears its
+    # temporary files on startup
+    cache_dir = os.path.join('downloads', 'workers', name)
+    os.environ.setdefault('AUDIO_CACHE_DIR', cache_dir)
+    # Rotating one log file from several processes loses records
+    os.environ.setdefault('LOG_FILE', f'worker-{name}.log')
+    os.environ['DOWNLOAD_BACKEND'] = 'queue'
+    os.environ['DOWNLOAD_WORKER'] = 'true'
+    # Workers on the same host share its cores
+    if args.transcode_workers:
+        os.environ['TRANSCODE_WORKERS'] = str(args.transcode_workers)
+    elif args.jobs:
+        os.environ['TRANSCODE_WORKERS'] = str(min(args.jobs, os.cpu_count() or 1))
+
+    import main as bot
+
+    worker = Worker(bot, name, args.jobs or bot.DOWNLOAD_WORKERS)
+    if args.metrics_port:
+        bot.metrics.serve(bot.METRICS_HOST, args.metrics_port)
+    try:
+        asyncio.run(worker.run())
+    finally:
+        bot.shutdown()
+        if not args.name and bot.AUDIO_CACHE_DIR == cache_dir:
+            shutil.rmtree(cache_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
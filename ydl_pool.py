@@ -0,0 +1,77 @@
+import queue
+import logging
+from contextlib import contextmanager
+import yt_dlp
+
+logger = logging.getLogger(__name__)
+
+
+class YoutubeDLPool:
+    """Pool of long-lived, pre-warmed YoutubeDL instances per option profile
+
+    Creating a YoutubeDL and initializing its YouTube extractor costs tens
+    of milliseconds, and each instance keeps its own HTTP connections and
+    extractor caches. Leasing instances from a pool pays that cost once per
+    instance instead of once per request. Each instance is used by a single
+    thread at a time.
+    """
+
+    def __init__(self, profiles):
+        """profiles maps a profile name to (pool size, yt-dlp options)"""
+        self.profiles = profiles
+        self._idle = {}
+        self._hooks = {}
+        for name, (size, _) in profiles.items():
+            self._idle[name] = queue.LifoQueue()
+            for _ in range(size):
+                self._idle[name].put(self._create(name))
+        logger.info(
+            "YoutubeDL pool ready: " +
+            ", ".join(f"{name}={size}" for name, (size, _) in profiles.items())
+        )
+
+    def _create(self, profile):
+        ydl = yt_dlp.YoutubeDL(dict(self.profiles[profile][1]))
+        ydl.get_info_extractor('Youtube')
+        # Progress hooks are fixed when an instance is created, so every
+        # instance gets one hook that forwards to the current lease's hook
+        ydl.add_progress_hook(lambda progress, key=id(ydl): self._dispatch(key, progress))
+        return ydl
+
+    def _dispatch(self, key, progress):
+        hook = self._hooks.get(key)
+        if hook is not None:
+            hook(progress)
+
+    @contextmanager
+    def lease(self, profile, outtmpl=None, progress_hook=None, format_spec=None):
+        """Borrow an instance of a profile, optionally with its own output template, progress hook and format
+
+        Blocks until an instance is free.
+        """
+        ydl = self._idle[profile].get()
+        saved_outtmpl = ydl.params['outtmpl']
+        saved_format = (ydl.params.get('format'), ydl.format_selector)
+        if outtmpl is not None:
+            ydl.params['outtmpl'] = {**saved_outtmpl, 'default': outtmpl}
+        if format_spec is not None:
+            # The format selector is compiled when an instance is created
+            ydl.params['format'] = format_spec
+            ydl.format_selector = ydl.build_format_selector(format_spec)
+        self._hooks[id(ydl)] = progress_hook
+        try:
+            yield ydl
+        finally:
+            self._hooks.pop(id(ydl), None)
+            ydl.params['outtmpl'] = saved_outtmpl
+            ydl.params['format'], ydl.format_selector = saved_format
+            self._idle[profile].put(ydl)
+
+    def close(self):
+        """Close every idle instance"""
+        for idle in self._idle.values():
+            while True:
+                try:
+                    idle.get_nowait().close()
+                except queue.Empty:
+                    break